@@ -0,0 +1,42 @@
+from threading import Lock
+from typing import Optional
+
+from pipeline import ImagePipeline
+
+# "random" accepts every task, "load" rejects tasks at random with the load probability and "admission" rejects tasks
+# only when the compute node is actually busy
+COMPUTE_POLICIES = ['random', 'load', 'admission']
+
+class AdmissionController:
+    """
+    Admits tasks to a compute node while it runs fewer than max_inflight tasks and images wait less than
+    max_queue_wait seconds on average before the compute stage of its pipeline picks them up. A rejection comes with
+    an estimate of how many seconds to wait before the node has room again.
+    """
+    def __init__(self, pipeline: ImagePipeline, max_inflight: int, max_queue_wait: float, min_retry_after: float = 0.01):
+        self.pipeline = pipeline
+        self.max_inflight = max_inflight
+        self.max_queue_wait = max_queue_wait
+        self.min_retry_after = min_retry_after
+        self.inflight = 0
+        self.lock = Lock()
+
+    def try_admit(self, num_waiting: int = 0) -> Optional[float]:
+        # Return None if the task is admitted, otherwise the number of seconds after which to try again, where
+        # num_waiting tasks sent along with this one were rejected before it and are retried at the same time
+        with self.lock:
+            # An idle node always admits tasks, since its queue wait is only measured while tasks flow through it
+            if self.inflight > 0:
+                # Tasks finish at a rate of about max_inflight per pipeline latency
+                finish_time = self.pipeline.latency / self.max_inflight
+                if self.inflight >= self.max_inflight:
+                    excess = self.inflight - self.max_inflight + 1 + num_waiting
+                    return max(self.min_retry_after, excess * finish_time)
+                if self.pipeline.queue_wait > self.max_queue_wait:
+                    return max(self.min_retry_after, self.pipeline.queue_wait - self.max_queue_wait + num_waiting * finish_time)
+            self.inflight += 1
+            return None
+
+    def finish(self) -> None:
+        with self.lock:
+            self.inflight -= 1
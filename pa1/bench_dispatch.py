@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+import threading
+from threading import Thread, Event
+
+from server import PROJ_PATH, DISPATCH_MODES, ServerHandler, get_compute_nodes
+from gen.service.ttypes import Job
+
+# Compares the job delay and the number of server threads of the "thread" and "pool" dispatch modes as jobs grow.
+# The compute nodes listed in the "machine.txt" file must already be running, e.g. with the "load_probs" set to 0.
+
+# Function to record the largest number of threads running in this process until stop is set
+def sample_threads(stop: Event, peak: list) -> None:
+    while not stop.is_set():
+        peak[0] = max(peak[0], threading.active_count())
+        stop.wait(0.01)
+
+if __name__ == '__main__':
+    job_sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else [6, 60, 600]
+    num_samples = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    output_file = sys.argv[3] if len(sys.argv) > 3 else 'dispatch.csv'
+
+    compute_nodes = get_compute_nodes()
+    input_dir = os.path.join(PROJ_PATH, 'input_dir')
+    file_names = sorted(f for f in os.listdir(input_dir) if os.path.isfile(os.path.join(input_dir, f)))
+
+    rows = ['dispatch_mode,job_size,samples,avg_delay,peak_threads']
+    for dispatch_mode in DISPATCH_MODES:
+        handler = ServerHandler(compute_nodes, dispatch_mode)
+        for job_size in job_sizes:
+            # Repeat the input images until the job has job_size files
+            job = Job(PROJ_PATH, [file_names[i % len(file_names)] for i in range(job_size)])
+            stop = Event()
+            peak = [0]
+            sampler = Thread(target=sample_threads, args=[stop, peak])
+            sampler.start()
+            start = time.time()
+            for _ in range(num_samples):
+                handler.process(job)
+            avg_delay = (time.time() - start) / num_samples
+            stop.set()
+            sampler.join()
+            print(f"[Benchmark] {dispatch_mode} dispatch mode with {job_size} files: {avg_delay} seconds per job, {peak[0]} threads at peak.")
+            rows.append(f'{dispatch_mode},{job_size},{num_samples},{avg_delay},{peak[0]}')
+        # Stop the workers of the handler so that they are not counted in the threads of the next mode
+        handler.shutdown()
+    with open(output_file, 'w') as file:
+        file.write('\n'.join(rows) + '\n')
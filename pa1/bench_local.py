@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+from random import random, expovariate, uniform
+from threading import Thread
+
+from server import PROJ_PATH, ServerHandler
+from scheduler import SCHEDULING_POLICIES
+from bench_scheduler import theoretical_delay
+from gen.service import ComputeService
+from gen.service.ttypes import Job, TaskRejected, TaskState, TaskStatus
+
+from thrift.transport import TSocket
+from thrift.transport import TTransport
+from thrift.protocol import TBinaryProtocol
+from thrift.server import TServer
+
+# Reproduces the experiments behind the plots in the README on a single machine. The compute nodes run on localhost,
+# either as in-process stand-ins which sleep for a random service time instead of processing the images, or as
+# "computeNode.py" processes. For each load profile and compute policy, the benchmark submits the job in the input
+# directory num_samples times under each scheduling policy and records the average job delay, the theoretical delay
+# of random scheduling, the average number of rejected tasks per job and the fraction of the time each compute node
+# had tasks in flight to the output file, which "plots.py" reads.
+
+# "simulated" serves in-process stand-ins for the compute nodes, "process" starts a process for each compute node
+BACKENDS = ['simulated', 'process']
+# Distributions of the service time of the simulated compute nodes, which all have the given mean
+SERVICE_TIME_DISTRIBUTIONS = ['constant', 'exponential', 'uniform']
+
+# Load probabilities of the four compute nodes in each load profile. The "uniform" profiles are compared with the
+# theoretical delay, and the others compare the compute and scheduling policies with each other.
+UNIFORM_PROFILES = {f'uniform_{p}': [p] * 4 for p in [0.0, 0.1, 0.2, 0.4, 0.6, 0.8, 1.0]}
+MIXED_PROFILES = {'low': [0.2] * 4, 'high': [0.8] * 4, 'mixed': [0.1, 0.5, 0.2, 0.9]}
+
+class SimulatedComputeHandler:
+    """
+    Stand-in for a compute node which sleeps for a service time drawn from the given distribution instead of
+    processing each image, with the same load probability, load delay and "random" and "load" compute policies as a
+    compute node. The tasks of a batch are waited out at the same time, like in the pipeline of a compute node.
+    """
+    def __init__(self, service_time: float, distribution: str, load_delay: float):
+        self.service_time = service_time
+        self.distribution = distribution
+        self.load_delay = load_delay
+        self.load_probability = 0.0
+        self.policy = 'random'
+
+    def get_duration(self) -> float:
+        # Either reject the task or draw the time it takes to process it, including the injected delay
+        if self.policy == 'load' and random() <= self.load_probability:
+            raise TaskRejected("Load exceeded", 0)
+        if self.distribution == 'exponential':
+            duration = expovariate(1 / self.service_time) if self.service_time > 0 else 0
+        elif self.distribution == 'uniform':
+            duration = uniform(0, 2 * self.service_time)
+        else:
+            duration = self.service_time
+        if random() <= self.load_probability:
+            duration += self.load_delay
+        return duration
+
+    def process(self, task) -> None:
+        time.sleep(self.get_duration())
+
+    def process_batch(self, tasks: list) -> list:
+        statuses = []
+        for _ in tasks:
+            try:
+                statuses.append(TaskStatus(TaskState.PROCESSED, '', self.get_duration(), None, 0, 0))
+            except TaskRejected as e:
+                statuses.append(TaskStatus(TaskState.REJECTED, e.why, 0, None, e.retry_after, 0))
+        time.sleep(max([status.duration for status in statuses], default=0))
+        return statuses
+
+# Function to find a port on localhost which no one listens on
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+# Function to wait until a compute node listens on the given port
+def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('localhost', port), timeout=0.2).close()
+            return
+        except OSError as e:
+            if time.time() > deadline:
+                raise TimeoutError(f"No compute node is listening on port {port}") from e
+            time.sleep(0.05)
+
+# Function to serve a simulated compute node on the given port from a background thread
+def serve_simulated_node(handler: SimulatedComputeHandler, port: int) -> None:
+    processor = ComputeService.Processor(handler)
+    transport = TSocket.TServerSocket(host='localhost', port=port)
+    tfactory = TTransport.TBufferedTransportFactory()
+    pfactory = TBinaryProtocol.TBinaryProtocolFactory()
+    server = TServer.TThreadedServer(processor, transport, tfactory, pfactory, daemon=True)
+    Thread(target=server.serve, daemon=True).start()
+
+# Function to start a "computeNode.py" process for each port with the given compute options, which the processes read
+# from a copy of the "config.json" file in config_dir
+def start_compute_nodes(ports: list, load_probs: list, compute_policy: str, load_delay: float, config_dir: str) -> list:
+    config = {}
+    config_file = os.path.join(PROJ_PATH, 'config.json')
+    if os.path.exists(config_file):
+        with open(config_file) as json_file:
+            config = json.load(json_file)
+    config.setdefault('compute', {}).update(compute_policy=compute_policy, load_probs=load_probs, load_delay=load_delay)
+    with open(os.path.join(config_dir, 'config.json'), 'w') as json_file:
+        json.dump(config, json_file)
+
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PROJ_PATH=config_dir)
+    processes = [subprocess.Popen([sys.executable, 'computeNode.py', str(n), str(port)], cwd=source_dir, env=env, stdout=subprocess.DEVNULL) for n, port in enumerate(ports)]
+    for port in ports:
+        wait_for_port(port)
+    return processes
+
+if __name__ == '__main__':
+    backend = sys.argv[1] if len(sys.argv) > 1 else 'simulated'
+    num_samples = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    output_file = sys.argv[3] if len(sys.argv) > 3 else 'bench.csv'
+    load_delay = float(sys.argv[4]) if len(sys.argv) > 4 else 3.0
+    service_time = float(sys.argv[5]) if len(sys.argv) > 5 else 0.01
+    distribution = sys.argv[6] if len(sys.argv) > 6 else 'exponential'
+
+    if backend not in BACKENDS or distribution not in SERVICE_TIME_DISTRIBUTIONS:
+        print(f"[Benchmark] Unknown backend \"{backend}\" or service time distribution \"{distribution}\", expected one of {BACKENDS} and one of {SERVICE_TIME_DISTRIBUTIONS}, exiting...")
+        sys.exit(1)
+
+    # The compute node processes read and write the images of the job from their own working directory
+    data_dir = os.path.abspath(PROJ_PATH)
+    input_dir = os.path.join(data_dir, 'input_dir')
+    file_names = sorted(f for f in os.listdir(input_dir) if os.path.isfile(os.path.join(input_dir, f)))
+    job = Job(data_dir, file_names)
+
+    # Every load profile runs under the "random" compute policy, and the mixed profiles under every other compute
+    # policy as well, except that only compute node processes implement the "admission" compute policy
+    compute_policies = ['random', 'load'] + (['admission'] if backend == 'process' else [])
+    experiments = [(profile, load_probs, 'random', ['random']) for profile, load_probs in UNIFORM_PROFILES.items()]
+    experiments += [(profile, load_probs, compute_policy, SCHEDULING_POLICIES) for compute_policy in compute_policies for profile, load_probs in MIXED_PROFILES.items()]
+
+    ports = [get_free_port() for _ in range(4)]
+    compute_nodes = [f'localhost:{port}' for port in ports]
+    simulated_nodes = []
+    if backend == 'simulated':
+        for port in ports:
+            simulated_nodes.append(SimulatedComputeHandler(service_time, distribution, load_delay))
+            serve_simulated_node(simulated_nodes[-1], port)
+            wait_for_port(port)
+
+    with open(output_file, 'w') as file, tempfile.TemporaryDirectory() as config_dir:
+        file.write('backend,load_profile,load_probs,compute_policy,scheduling_policy,p_avg,theoretical,observed,retries,utilization\n')
+        for profile, load_probs, compute_policy, scheduling_policies in experiments:
+            processes = []
+            if backend == 'simulated':
+                for node, load_probability in zip(simulated_nodes, load_probs):
+                    node.load_probability, node.policy = load_probability, compute_policy
+            else:
+                processes = start_compute_nodes(ports, load_probs, compute_policy, load_delay, config_dir)
+            try:
+                p_avg = sum(load_probs) / len(load_probs)
+                theoretical = theoretical_delay(load_probs, load_delay, compute_policy, len(file_names))
+                for scheduling_policy in scheduling_policies:
+                    handler = ServerHandler(compute_nodes, scheduling_policy=scheduling_policy)
+                    start = time.time()
+                    try:
+                        observed = sum(handler.process(job) for _ in range(num_samples)) / num_samples
+                    finally:
+                        # Stop the workers of the handler and close their connections so that the threads of one
+                        # experiment do not carry over into the next
+                        handler.shutdown()
+                    duration = time.time() - start
+                    retries = sum(stats.rejected for stats in handler.scheduler.nodes) / num_samples
+                    utilization = [stats.busy_time / duration for stats in handler.scheduler.nodes]
+                    print(f"[Benchmark] {profile} load profile, {compute_policy} compute policy, {scheduling_policy} scheduling policy: {observed} seconds per job against {theoretical} seconds in theory, {retries} retries per job, utilization {utilization}.")
+                    file.write(f"{backend},{profile},{' '.join(map(str, load_probs))},{compute_policy},{scheduling_policy},{p_avg},{theoretical},{observed},{retries},{' '.join(map(str, utilization))}\n")
+                    file.flush()
+            finally:
+                for process in processes:
+                    process.kill()
+                    process.wait()
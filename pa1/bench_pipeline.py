@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import tempfile
+
+import cv2
+
+from pipeline import ImagePipeline
+
+# Measures the throughput in images per second of processing the images one after another, like the compute nodes
+# used to, and of the image pipeline for a growing number of compute threads
+
+PROJ_PATH = os.getenv('PROJ_PATH')
+if PROJ_PATH is None:
+    PROJ_PATH = '.'
+
+# Function to read, process and write each image one after another on the calling thread
+def process_sequentially(input_files: list, output_dir: str) -> None:
+    for i, input_file in enumerate(input_files):
+        img = cv2.imread(filename=input_file)
+        gray = cv2.cvtColor(src=img, code=cv2.COLOR_BGR2GRAY)
+        edges = cv2.Canny(image=gray, threshold1=100, threshold2=200)
+        cv2.imwrite(filename=os.path.join(output_dir, f'{i}_{os.path.basename(input_file)}'), img=edges)
+
+# Function to process every image through the pipeline and wait for all of them
+def process_pipelined(pipeline: ImagePipeline, input_files: list, output_dir: str) -> None:
+    futures = [pipeline.submit(input_file, os.path.join(output_dir, f'{i}_{os.path.basename(input_file)}')) for i, input_file in enumerate(input_files)]
+    for future in futures:
+        future.result()
+
+if __name__ == '__main__':
+    num_images = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    output_file = sys.argv[2] if len(sys.argv) > 2 else 'pipeline.csv'
+    worker_counts = sorted({1, 2, 4, os.cpu_count()} & set(range(1, os.cpu_count() + 1)))
+
+    # Repeat the input images until there are num_images of them
+    input_dir = os.path.join(PROJ_PATH, 'input_dir')
+    file_names = sorted(f for f in os.listdir(input_dir) if os.path.isfile(os.path.join(input_dir, f)))
+    input_files = [os.path.join(input_dir, file_names[i % len(file_names)]) for i in range(num_images)]
+
+    rows = ['mode,workers,cores,images,seconds,throughput']
+    with tempfile.TemporaryDirectory() as output_dir:
+        cv2.setNumThreads(1)
+        start = time.time()
+        process_sequentially(input_files, output_dir)
+        duration = time.time() - start
+        print(f"[Benchmark] sequential: {num_images / duration} images/sec.")
+        rows.append(f'sequential,1,{os.cpu_count()},{num_images},{duration},{num_images / duration}')
+
+        for num_workers in worker_counts:
+            pipeline = ImagePipeline(num_workers=num_workers)
+            start = time.time()
+            process_pipelined(pipeline, input_files, output_dir)
+            duration = time.time() - start
+            print(f"[Benchmark] pipeline with {num_workers} compute threads: {num_images / duration} images/sec.")
+            rows.append(f'pipeline,{num_workers},{os.cpu_count()},{num_images},{duration},{num_images / duration}')
+    with open(output_file, 'w') as file:
+        file.write('\n'.join(rows) + '\n')
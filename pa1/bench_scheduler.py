@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+
+from server import PROJ_PATH, ServerHandler, get_compute_nodes
+from scheduler import SCHEDULING_POLICIES
+from gen.service.ttypes import Job
+
+# Compares the average job delay of each scheduling policy with the theoretical delay of random scheduling derived
+# in the README. The compute nodes listed in the "machine.txt" file must already be running with the compute options
+# in the "config.json" file, which the benchmark reads to compute the theoretical delay.
+
+# Function to compute the expected delay of a job of num_tasks tasks when tasks are assigned to random compute nodes
+def theoretical_delay(load_probs: list, load_delay: float, compute_policy: str, num_tasks: int) -> float:
+    p_avg = sum(load_probs) / len(load_probs)
+    p_delay = p_avg
+    if compute_policy == 'load':
+        # A task is retried until a node accepts it, so only the delay of the accepting node counts
+        p_delay = (sum(p * (1 - p) for p in load_probs) / len(load_probs)) / (1 - p_avg) if p_avg < 1 else 1
+    return load_delay - load_delay * (1 - p_delay) ** num_tasks
+
+if __name__ == '__main__':
+    num_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    output_file = sys.argv[2] if len(sys.argv) > 2 else 'scheduler.csv'
+
+    with open(os.path.join(PROJ_PATH, 'config.json')) as json_file:
+        compute_config = json.load(json_file).get('compute', {})
+    compute_nodes = get_compute_nodes()
+    compute_policy = compute_config.get('compute_policy', 'random')
+    load_probs = compute_config.get('load_probs', [])
+    load_probs = [load_probs[n] if n < len(load_probs) else 0.5 for n in range(len(compute_nodes))]
+    load_delay = compute_config.get('load_delay', 3)
+
+    input_dir = os.path.join(PROJ_PATH, 'input_dir')
+    file_names = [f for f in os.listdir(input_dir) if os.path.isfile(os.path.join(input_dir, f))]
+    job = Job(PROJ_PATH, file_names)
+    p_avg = sum(load_probs) / len(load_probs)
+    theoretical = theoretical_delay(load_probs, load_delay, compute_policy, len(file_names))
+
+    rows = []
+    if not os.path.exists(output_file):
+        rows.append('scheduling_policy,compute_policy,p_avg,theoretical,observed,retries')
+    for scheduling_policy in SCHEDULING_POLICIES:
+        handler = ServerHandler(compute_nodes, scheduling_policy=scheduling_policy)
+        total_duration = sum(handler.process(job) for _ in range(num_samples))
+        observed = total_duration / num_samples
+        retries = sum(stats.rejected for stats in handler.scheduler.nodes) / num_samples
+        # Stop the workers of the handler so that they do not skew the measurements of the next policy
+        handler.shutdown()
+        print(f"[Benchmark] {scheduling_policy} scheduling policy: {observed} seconds per job against {theoretical} seconds in theory, {retries} retries per job.")
+        rows.append(f'{scheduling_policy},{compute_policy},{p_avg},{theoretical},{observed},{retries}')
+    # Append to the output file so that runs with different compute options end up in the same file
+    with open(output_file, 'a') as file:
+        file.write('\n'.join(rows) + '\n')
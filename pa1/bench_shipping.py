@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+
+from server import PROJ_PATH, ServerHandler, get_compute_nodes
+from payload import PAYLOAD_ENCODINGS
+from gen.service.ttypes import Job
+
+# Compares the throughput of letting the compute nodes read and write images on the shared file system with that of
+# shipping the images and their results in the tasks, raw and compressed. The compute nodes listed in the
+# "machine.txt" file must already be running, e.g. with the "load_probs" set to 0.
+
+if __name__ == '__main__':
+    job_size = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    num_samples = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    output_file = sys.argv[3] if len(sys.argv) > 3 else 'shipping.csv'
+
+    compute_nodes = get_compute_nodes()
+    input_dir = os.path.join(PROJ_PATH, 'input_dir')
+    file_names = sorted(f for f in os.listdir(input_dir) if os.path.isfile(os.path.join(input_dir, f)))
+    # Repeat the input images until the job has job_size files
+    job = Job(PROJ_PATH, [file_names[i % len(file_names)] for i in range(job_size)])
+
+    rows = ['data_shipping,payload_encoding,job_size,samples,avg_delay,throughput']
+    for data_shipping, payload_encoding in [('shared', 'raw')] + [('bytes', encoding) for encoding in PAYLOAD_ENCODINGS]:
+        handler = ServerHandler(compute_nodes, data_shipping=data_shipping, payload_encoding=payload_encoding)
+        start = time.time()
+        for _ in range(num_samples):
+            handler.process(job)
+        avg_delay = (time.time() - start) / num_samples
+        # Stop the workers of the handler so that they do not skew the measurements of the next mode
+        handler.shutdown()
+        print(f"[Benchmark] {data_shipping} data shipping with {payload_encoding} payloads: {avg_delay} seconds per job, {job_size / avg_delay} images/sec.")
+        rows.append(f'{data_shipping},{payload_encoding},{job_size},{num_samples},{avg_delay},{job_size / avg_delay}')
+    with open(output_file, 'w') as file:
+        file.write('\n'.join(rows) + '\n')
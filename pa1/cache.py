@@ -0,0 +1,83 @@
+import os
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+# Thresholds of the Canny filter, which change the result of an image and so are part of its key in the cache
+CANNY_THRESHOLDS = (100, 200)
+
+# Function to compute the key of the result of an image from its contents, its format and the filter thresholds
+def get_cache_key(content: bytes, file_name: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(f'{CANNY_THRESHOLDS[0]},{CANNY_THRESHOLDS[1]},{os.path.splitext(file_name)[1].lower()};'.encode('utf-8'))
+    digest.update(content)
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Size-bounded store of processed images on disk, with a file per result named by its key. The least recently
+    used results are evicted once the results take more than max_bytes. The order of use survives restarts through
+    the modification times of the files, which are updated on every hit.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        # Maps the key of each result to its size, from the least to the most recently used
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.endswith('.tmp'):
+                # Left behind by an interrupted write
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+        self.evict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        path = os.path.join(self.cache_dir, key)
+        try:
+            with open(path, 'rb') as file:
+                result = file.read()
+            os.utime(path)
+            return result
+        except OSError as _:
+            # Evicted by another thread since the lookup
+            return None
+
+    def put(self, key: str, result: bytes) -> None:
+        if len(result) > self.max_bytes:
+            return
+        # Write to a temporary file first so that a crash never leaves a partial result behind
+        path = os.path.join(self.cache_dir, key)
+        temp_path = f'{path}.{id(result)}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(result)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.total_bytes += len(result) - self.entries.pop(key, 0)
+            self.entries[key] = len(result)
+            self.evict()
+
+    def evict(self) -> None:
+        # Remove the least recently used results until the cache fits, with the lock held
+        while self.total_bytes > self.max_bytes and len(self.entries) > 0:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, key))
+            except OSError as _:
+                pass
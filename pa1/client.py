@@ -16,7 +16,7 @@ import json
 import time
 
 from gen.service import ServerService
-from gen.service.ttypes import Job
+from gen.service.ttypes import Job, TaskState
 
 from thrift.transport import TSocket
 from thrift.protocol import TBinaryProtocol
@@ -44,11 +44,30 @@ def load_client_config() -> dict:
             config = config.get('client', {})
     return config
 
+# Function to submit a job without blocking and print the result of each task as the server finishes it
+def stream_job(client, job: Job, timeout: float) -> float:
+    job_id = client.submit_job(job)
+    offset = 0
+    while True:
+        progress = client.stream_results(job_id, offset, timeout)
+        for result in progress.results:
+            if result.state == TaskState.PROCESSED:
+                source = 'from the result cache' if result.cache_hit else f'after {result.rejections} rejections with a peak memory of {result.peak_memory} bytes'
+                print(f"[Client] Processed \"{result.file_name}\" in {result.duration} seconds {source}.")
+            else:
+                print(f"[Client] Failed to process \"{result.file_name}\": {result.why}")
+        offset += len(progress.results)
+        print(f"[Client] Job {job_id} has finished {progress.num_finished} of {progress.num_tasks} tasks in {progress.elapsed} seconds.")
+        if progress.finished:
+            return progress.elapsed
+
 if __name__ == '__main__':
     # Get the server ip and load the client config
     server = get_server()
     client_config = load_client_config()
     num_samples = client_config.get('num_samples', 1)
+    stream_results = client_config.get('stream_results', False)
+    stream_timeout = client_config.get('stream_timeout', 1.0)
 
     if server is None:
         print('[Client] No server was provided in the \"machine.txt\" file, exiting...')
@@ -68,7 +87,10 @@ if __name__ == '__main__':
         # Submit the job "num_samples" times
         for _ in range(num_samples):
             print(f"[Client] Submitting job to process images [{', '.join(file_names)}] in the directory {PROJ_PATH}")
-            duration = client.process(job)
+            if stream_results:
+                duration = stream_job(client, job, stream_timeout)
+            else:
+                duration = client.process(job)
             print(f"[Client] Server finished processing job in {duration} seconds.")
             total_duration += duration
     
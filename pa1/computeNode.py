@@ -17,46 +17,113 @@ PROJ_PATH = os.getenv('PROJ_PATH')
 if PROJ_PATH is None:
     PROJ_PATH = '.'
 
-import cv2
-
 from random import random
-from time import sleep
+from time import time
+from concurrent.futures import Future
+from typing import Optional
 import json
 
 from gen.service import ComputeService
-from gen.service.ttypes import Task, TaskRejected
+from gen.service.ttypes import Task, TaskRejected, TaskState, TaskStatus
 
 from thrift.transport import TSocket
 from thrift.transport import TTransport
 from thrift.protocol import TBinaryProtocol
 from thrift.server import TServer
 
+from pipeline import ImagePipeline
+from admission import COMPUTE_POLICIES, AdmissionController
+from payload import encode_payload, decode_payload
+
 class ComputeHandler:
-    def __init__(self, load_probability: float, load_delay: float, policy: str):
+    def __init__(self, load_probability: float, load_delay: float, policy: str, pipeline: ImagePipeline, admission: Optional[AdmissionController] = None):
         self.load_probability = load_probability
         self.load_delay = load_delay
         self.policy = policy
+        self.pipeline = pipeline
+        self.admission = admission
 
-    def process(self, task: Task) -> None:
+    def admit(self, task: Task, num_rejected: int = 0) -> float:
+        # Either reject the task or return the delay to inject before processing it, where num_rejected tasks of the
+        # same batch were rejected before it
         print(f"[Compute {node_num}] Recieved task to process the file \"{task.file_name}\".")
         # If the policy is "load", reject the task with probability load_probability
         if self.policy == 'load' and random() <= self.load_probability:
             print(f"[Compute {node_num}] Load exceeded, rejecting task.")
-            raise TaskRejected("Load exceeded")
+            raise TaskRejected("Load exceeded", 0)
+
+        # If the policy is "admission", reject the task when the node is busy
+        if self.policy == 'admission':
+            retry_after = self.admission.try_admit(num_rejected)
+            if retry_after is not None:
+                print(f"[Compute {node_num}] Node is busy, rejecting task with a retry after {retry_after} seconds.")
+                raise TaskRejected("Node is busy", retry_after)
 
-        # Inject delay with probability load_probability
+        # Inject delay with probability load_probability, which the pipeline waits out without holding a thread
         if random() <= self.load_probability:
             print(f"[Compute {node_num}] Injecting delay of {self.load_delay} seconds.")
-            sleep(self.load_delay)
+            return self.load_delay
+        return 0
+
+    def submit(self, task: Task, delay: float) -> Future:
+        try:
+            input_file = os.path.join(task.data_dir, 'input_dir', task.file_name)
+            if task.content is not None:
+                # The server shipped the image itself, so the result is returned instead of being written
+                future = self.pipeline.submit(input_file, None, decode_payload(task.content, task.encoding), delay)
+            else:
+                # Read the image, process it and write the result to the output directory in the pipeline, or only
+                # a band of it when the server split a very large image across compute nodes
+                output_file = os.path.join(task.data_dir, 'output_dir', task.file_name)
+                band = None if task.num_bands is None else (task.band, task.num_bands)
+                future = self.pipeline.submit(input_file, output_file, delay=delay, band=band)
+        except Exception as _:
+            if self.admission is not None:
+                self.admission.finish()
+            raise
+        # The task counts as in flight until the pipeline is done with it
+        if self.admission is not None:
+            future.add_done_callback(lambda _: self.admission.finish())
+        return future
+
+    def process(self, task: Task) -> None:
+        _, peak_memory = self.submit(task, self.admit(task)).result()
+        print(f"[Compute {node_num}] Finished processing \"{task.file_name}\" with a peak memory of {peak_memory} bytes.")
+
+    def process_batch(self, tasks: list) -> list:
+        print(f"[Compute {node_num}] Recieved a batch of {len(tasks)} tasks.")
+        # Submit every accepted task to the pipeline before waiting on any of them so that the tasks overlap
+        start = time()
+        futures = []
+        num_rejected = 0
+        for task in tasks:
+            try:
+                futures.append(self.submit(task, self.admit(task, num_rejected)))
+            except TaskRejected as e:
+                futures.append(e)
+                num_rejected += 1
+            except Exception as e:
+                futures.append(e)
+
+        # A rejection or a failure only affects its own task
+        statuses = []
+        for task, future in zip(tasks, futures):
+            if isinstance(future, TaskRejected):
+                statuses.append(TaskStatus(TaskState.REJECTED, future.why, 0, None, future.retry_after, 0))
+                continue
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                result, peak_memory = future.result()
+                if result is not None:
+                    result = encode_payload(result, task.encoding)
+                print(f"[Compute {node_num}] Finished processing \"{task.file_name}\" with a peak memory of {peak_memory} bytes.")
+                statuses.append(TaskStatus(TaskState.PROCESSED, '', time() - start, result, 0, peak_memory))
+            except Exception as e:
+                print(f"[Compute {node_num}] Failed to process \"{task.file_name}\": {e}")
+                statuses.append(TaskStatus(TaskState.FAILED, str(e), time() - start, None, 0, 0))
+        return statuses
 
-        # Read the image and process it
-        img = cv2.imread(filename=os.path.join(task.data_dir, 'input_dir', task.file_name))
-        gray = cv2.cvtColor(src=img, code=cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(image=gray, threshold1=100, threshold2=200)
-        # Write the result to the output directory
-        cv2.imwrite(filename=os.path.join(task.data_dir, 'output_dir', task.file_name), img=edges)
-        print(f"[Compute {node_num}] Finished processing \"{task.file_name}\".")
-        
 
 # Function to load the compute config options from the "config.json" file
 def load_compute_config() -> dict:
@@ -72,7 +139,8 @@ def load_compute_config() -> dict:
 if __name__ == '__main__':
     # Get the node number and calculate the port the node should listen on
     node_num = int(sys.argv[1]) if len(sys.argv) > 1 else 0
-    node_port = 9091 + int(node_num)
+    # The port can be given after the node number, e.g. to run several compute nodes on the same host
+    node_port = int(sys.argv[2]) if len(sys.argv) > 2 else 9091 + node_num
 
     # Load the compute config
     compute_config = load_compute_config()
@@ -82,10 +150,25 @@ if __name__ == '__main__':
     load_probs = compute_config.get('load_probs', [])
     load_probability = load_probs[node_num] if node_num < len(load_probs) else 0.5
     load_delay = compute_config.get('load_delay', 3)
-
-    # Initialize the compute handler
-    handler = ComputeHandler(load_probability=load_probability, load_delay=load_delay, policy=compute_policy)
-    print(f"[Compute {node_num}] Initializing the compute handler with a load probability of {load_probability}, a load delay of {load_delay} seconds and a compute policy of \"{compute_policy}\".")
+    pipeline_readers = compute_config.get('pipeline_readers', 2)
+    pipeline_workers = compute_config.get('pipeline_workers', os.cpu_count())
+    pipeline_writers = compute_config.get('pipeline_writers', 2)
+    pipeline_queue_size = compute_config.get('pipeline_queue_size', 16)
+    opencv_threads = compute_config.get('opencv_threads', 1)
+    max_inflight = compute_config.get('max_inflight', 4 * pipeline_queue_size)
+    max_queue_wait = compute_config.get('max_queue_wait', 0.5)
+    tile_size = compute_config.get('tile_size', 1024)
+    tile_margin = compute_config.get('tile_margin', 16)
+
+    if compute_policy not in COMPUTE_POLICIES:
+        print(f"[Compute {node_num}] Unknown compute policy \"{compute_policy}\", expected one of {COMPUTE_POLICIES}, exiting...")
+        sys.exit(1)
+
+    # Initialize the image pipeline and the compute handler
+    pipeline = ImagePipeline(pipeline_readers, pipeline_workers, pipeline_writers, pipeline_queue_size, opencv_threads, tile_size=tile_size, tile_margin=tile_margin)
+    admission = AdmissionController(pipeline, max_inflight, max_queue_wait) if compute_policy == 'admission' else None
+    handler = ComputeHandler(load_probability=load_probability, load_delay=load_delay, policy=compute_policy, pipeline=pipeline, admission=admission)
+    print(f"[Compute {node_num}] Initializing the compute handler with a load probability of {load_probability}, a load delay of {load_delay} seconds, a compute policy of \"{compute_policy}\" and {pipeline_workers} compute threads.")
 
     # Initialize and compute service processor
     processor = ComputeService.Processor(handler)
@@ -0,0 +1,15 @@
+import zlib
+
+# "raw" ships image bytes as they are stored on disk, "zlib" compresses them first
+PAYLOAD_ENCODINGS = ['raw', 'zlib']
+
+def encode_payload(data: bytes, encoding: str) -> bytes:
+    if encoding == 'zlib':
+        # The fastest compression level, since most image formats are already compressed
+        return zlib.compress(data, 1)
+    return data
+
+def decode_payload(data: bytes, encoding: str) -> bytes:
+    if encoding == 'zlib':
+        return zlib.decompress(data)
+    return data
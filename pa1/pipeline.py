@@ -0,0 +1,149 @@
+import os
+import heapq
+from time import time
+from queue import Queue
+from threading import Thread, Condition, Lock
+from concurrent.futures import Future
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from cache import CANNY_THRESHOLDS
+from tiling import detect_band_edges, get_gray_file
+
+class ImagePipeline:
+    """
+    Processes images in three stages connected by bounded queues: reader threads load images from disk, compute
+    threads convert them to grayscale and detect their edges, and writer threads save the results. OpenCV releases
+    the GIL while it reads, processes and writes images, so disk I/O overlaps with computation and the compute
+    threads run on separate cores. OpenCV's own threads are limited to opencv_threads so that they do not compete
+    with the compute threads for the same cores.
+
+    Images can also be passed in and returned as encoded bytes, for compute nodes which do not share a file system
+    with the server, and delayed without holding a thread. A band of a very large image is read from the grayscale
+    file the server decoded the image to, in overlapping tiles of tile_size pixels whose edges are streamed to a band
+    file on disk.
+
+    The result of each image comes with its peak memory: the largest number of bytes of image buffers it held at
+    once, not counting OpenCV's internal buffers and the memory-mapped grayscale and band files.
+
+    The pipeline keeps exponentially weighted moving averages of how long images wait before the compute stage
+    picks them up and of how long they take from entering the pipeline to being written.
+    """
+    def __init__(self, num_readers: int = 2, num_workers: int = os.cpu_count(), num_writers: int = 2, queue_size: int = 16, opencv_threads: int = 1, alpha: float = 0.2, tile_size: int = 1024, tile_margin: int = 16):
+        cv2.setNumThreads(opencv_threads)
+        self.tile_size = tile_size
+        self.tile_margin = tile_margin
+        self.alpha = alpha
+        self.read_queue = Queue(maxsize=queue_size)
+        self.compute_queue = Queue(maxsize=queue_size)
+        self.write_queue = Queue(maxsize=queue_size)
+        # Heap of (due time, sequence number, image) for the images which were submitted with a delay
+        self.delayed = []
+        self.delayed_cv = Condition()
+        self.sequence = 0
+        self.stats_lock = Lock()
+        self.queue_wait = 0.0
+        self.latency = 0.0
+        for target, count in [(self.run_reader, num_readers), (self.run_worker, num_workers), (self.run_writer, num_writers), (self.run_timer, 1)]:
+            for _ in range(count):
+                Thread(target=target, daemon=True).start()
+
+    def submit(self, input_file: str, output_file: Optional[str], content: Optional[bytes] = None, delay: float = 0, band: Optional[tuple] = None) -> Future:
+        # Blocks while the first stage is full and returns a future which is done once the result is written, whose
+        # result is the pair of the encoded result and the peak memory of the image. When content is given, the
+        # image is decoded from it instead of being read from input_file, and when there is no output_file, the
+        # encoded result is the result in the format of input_file and otherwise None. An image with a delay only
+        # enters the pipeline once the delay has passed. When band is a pair of the band number and the number of
+        # bands, only the edges of that band are detected in the grayscale file of output_file and written to the
+        # band file of output_file.
+        if band is not None and output_file is None:
+            raise ValueError("The edges of a band can only be written to a band file")
+        future = Future()
+        image = (input_file, output_file, content, band, future)
+        if delay > 0:
+            with self.delayed_cv:
+                heapq.heappush(self.delayed, (time() + delay, self.sequence, image))
+                self.sequence += 1
+                self.delayed_cv.notify()
+        else:
+            self.read_queue.put(image + (time(),))
+        return future
+
+    def record(self, queue_wait: Optional[float] = None, latency: Optional[float] = None) -> None:
+        with self.stats_lock:
+            if queue_wait is not None:
+                self.queue_wait = (1 - self.alpha) * self.queue_wait + self.alpha * queue_wait
+            if latency is not None:
+                self.latency = (1 - self.alpha) * self.latency + self.alpha * latency
+
+    def run_timer(self) -> None:
+        while True:
+            with self.delayed_cv:
+                while len(self.delayed) == 0 or self.delayed[0][0] > time():
+                    self.delayed_cv.wait(None if len(self.delayed) == 0 else self.delayed[0][0] - time())
+                _, _, image = heapq.heappop(self.delayed)
+            self.read_queue.put(image + (time(),))
+
+    def run_reader(self) -> None:
+        while True:
+            input_file, output_file, content, band, future, enqueued = self.read_queue.get()
+            try:
+                if band is not None:
+                    # The grayscale image of a band is memory-mapped, so that only the tiles of the band are read
+                    img = np.load(get_gray_file(output_file), mmap_mode='r')
+                elif content is None:
+                    img = cv2.imread(filename=input_file)
+                else:
+                    img = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if img is None:
+                    raise IOError(f"Could not read the image \"{input_file}\"")
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            peak_memory = 0 if band is not None else img.nbytes + (0 if content is None else len(content))
+            del content
+            self.compute_queue.put((img, input_file, output_file, band, future, enqueued, peak_memory))
+
+    def run_worker(self) -> None:
+        while True:
+            img, input_file, output_file, band, future, enqueued, peak_memory = self.compute_queue.get()
+            self.record(queue_wait=time() - enqueued)
+            try:
+                if band is None:
+                    gray = cv2.cvtColor(src=img, code=cv2.COLOR_BGR2GRAY)
+                    peak_memory = max(peak_memory, img.nbytes + gray.nbytes)
+                    # Drop the reference to the input so that only the queues bound the number of images in memory
+                    img = None
+                    edges = cv2.Canny(image=gray, threshold1=CANNY_THRESHOLDS[0], threshold2=CANNY_THRESHOLDS[1])
+                    peak_memory = max(peak_memory, gray.nbytes + edges.nbytes)
+                    del gray
+                else:
+                    # The edges are already on disk once the band is processed, so there is nothing left to write
+                    edges = None
+                    peak_memory = detect_band_edges(img, output_file, band[0], band[1], self.tile_size, self.tile_margin)
+                    img = None
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.write_queue.put((edges, input_file, output_file, future, enqueued, peak_memory))
+
+    def run_writer(self) -> None:
+        while True:
+            edges, input_file, output_file, future, enqueued, peak_memory = self.write_queue.get()
+            result = None
+            try:
+                if output_file is None:
+                    success, encoded = cv2.imencode(os.path.splitext(input_file)[1], edges)
+                    if not success:
+                        raise IOError(f"Could not encode the result of \"{input_file}\"")
+                    result = encoded.tobytes()
+                    peak_memory = max(peak_memory, edges.nbytes + len(result))
+                elif edges is not None and not cv2.imwrite(filename=output_file, img=edges):
+                    raise IOError(f"Could not write the image \"{output_file}\"")
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.record(latency=time() - enqueued)
+            future.set_result((result, peak_memory))
@@ -1,34 +1,61 @@
+import sys
+import csv
+
 from matplotlib import pyplot as plt
-from numpy import genfromtxt
 import numpy as np
 
+# Plots the results which "bench_local.py" writes to its output file
+
+# Function to read the rows of the results of the benchmark, converting the numbers
+def read_results(results_file: str) -> list:
+    with open(results_file) as file:
+        rows = list(csv.DictReader(file))
+    for row in rows:
+        for key in ['p_avg', 'theoretical', 'observed', 'retries']:
+            row[key] = float(row[key])
+        row['utilization'] = [float(u) for u in row['utilization'].split()]
+    return rows
+
 if __name__ == '__main__':
-    data = genfromtxt('random.csv', delimiter=',')[1:]
-    plt.plot(data[:,0], data[:,1], label='Theoretical')
-    plt.plot(data[:,0], data[:,2], label='Observed')
+    results_file = sys.argv[1] if len(sys.argv) > 1 else 'bench.csv'
+    rows = read_results(results_file)
+
+    # Observed and theoretical job delay of random scheduling when every compute node has the same load probability
+    data = sorted((row for row in rows if row['load_profile'].startswith('uniform') and row['compute_policy'] == 'random' and row['scheduling_policy'] == 'random'), key=lambda row: row['p_avg'])
+    plt.plot([row['p_avg'] for row in data], [row['theoretical'] for row in data], label='Theoretical')
+    plt.plot([row['p_avg'] for row in data], [row['observed'] for row in data], label='Observed')
     plt.xlabel('Average load probability')
     plt.ylabel('Average job delay (seconds)')
     plt.legend()
-    plt.show()
     plt.savefig('plot_random.png')
+    plt.show()
 
+    # Job delay of each compute and scheduling policy under low, high and mixed load probabilities
+    profiles = [profile for profile in ['low', 'high', 'mixed'] if any(row['load_profile'] == profile for row in rows)]
+    policies = sorted({(row['compute_policy'], row['scheduling_policy']) for row in rows if row['load_profile'] in profiles})
+    delays = {(row['load_profile'], row['compute_policy'], row['scheduling_policy']): row['observed'] for row in rows}
+    bar_width = 0.8 / max(1, len(policies))
 
-    bar_width = 0.25
-
-    random = [2.359, 3.025, 2.84]
-    load_balancing = [2.330, 3.037, 2.392]
-    
-    r1 = np.arange(len(random))
-    r2 = [x + bar_width for x in r1]
-    
     plt.clf()
-    plt.bar(r1, random, color='#557f2d', width=bar_width, edgecolor='white', label='random')
-    plt.bar(r2, load_balancing, color='#2d7f5e', width=bar_width, edgecolor='white', label='load balancing')
-    
+    for i, (compute_policy, scheduling_policy) in enumerate(policies):
+        bars = [delays.get((profile, compute_policy, scheduling_policy), np.nan) for profile in profiles]
+        plt.bar(np.arange(len(profiles)) + i * bar_width, bars, width=bar_width, edgecolor='white', label=f'{compute_policy} / {scheduling_policy}')
     plt.ylabel('Average job delay (seconds)')
-    plt.xticks([r + bar_width for r in range(len(random))], ['low', 'high', 'mixed'])
-    
-    plt.legend()
-    plt.show()
+    plt.xticks([r + bar_width * (len(policies) - 1) / 2 for r in range(len(profiles))], profiles)
+    plt.legend(title='compute / scheduling policy')
     plt.savefig('bar_chart.png')
+    plt.show()
 
+    # Utilization of each compute node under mixed load probabilities
+    data = [row for row in rows if row['load_profile'] == 'mixed']
+    if len(data) > 0:
+        bar_width = 0.8 / len(data)
+        plt.clf()
+        for i, row in enumerate(data):
+            plt.bar(np.arange(len(row['utilization'])) + i * bar_width, row['utilization'], width=bar_width, edgecolor='white', label=f"{row['compute_policy']} / {row['scheduling_policy']}")
+        plt.xlabel('Compute node')
+        plt.ylabel('Fraction of the time with tasks in flight')
+        plt.xticks([r + bar_width * (len(data) - 1) / 2 for r in range(len(data[0]['utilization']))], [f"node_{n} (p={p})" for n, p in enumerate(data[0]['load_probs'].split())])
+        plt.legend(title='compute / scheduling policy')
+        plt.savefig('plot_utilization.png')
+        plt.show()
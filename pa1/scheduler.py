@@ -0,0 +1,107 @@
+from random import random, choice, sample
+from time import time
+from threading import Condition
+from typing import Optional
+
+# "random" picks any compute node, "p2c" picks the better of two random compute nodes and "jsq" picks the best compute node
+SCHEDULING_POLICIES = ['random', 'p2c', 'jsq']
+
+class NodeStats:
+    def __init__(self):
+        # Number of tasks sent to the node which have not finished yet
+        self.inflight = 0
+        # Exponentially weighted moving averages of the service time in seconds and of the fraction of rejected tasks
+        self.service_time = 0.0
+        self.rejection_rate = 0.0
+        self.processed = 0
+        self.rejected = 0
+        # Time before which the node asked not to be sent more tasks
+        self.blocked_until = 0.0
+        # Total number of seconds the node had tasks in flight, and since when it has them if it has any
+        self.busy_time = 0.0
+        self.busy_since = 0.0
+
+class LoadScheduler:
+    """
+    Assigns tasks to compute nodes based on the number of tasks each node is running, how long its tasks take
+    and how often it rejects tasks. A node's expected delay is its service time multiplied by the number of tasks
+    it would be running, divided by the probability that it accepts the task. A node which rejects a task with a
+    retry-after hint is passed over until the hint expires, unless no other node has a free slot.
+    """
+    def __init__(self, num_nodes: int, policy: str = 'p2c', max_inflight: Optional[int] = None, alpha: float = 0.2, backoff_base: float = 0.05, backoff_cap: float = 2.0):
+        self.policy = policy
+        self.max_inflight = max_inflight
+        self.alpha = alpha
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.nodes = [NodeStats() for _ in range(num_nodes)]
+        self.slots = Condition()
+
+    def get_score(self, node_num: int) -> float:
+        stats = self.nodes[node_num]
+        # Unmeasured nodes get a small service time so that they are tried early on
+        service_time = max(stats.service_time, 0.001)
+        return (stats.inflight + 1) * service_time / max(1 - stats.rejection_rate, 0.01)
+
+    def acquire(self) -> int:
+        # Choose a compute node among the ones with free slots and count the task as in flight on it
+        with self.slots:
+            while True:
+                free = [n for n, stats in enumerate(self.nodes) if self.max_inflight is None or stats.inflight < self.max_inflight]
+                now = time()
+                ready = [n for n in free if self.nodes[n].blocked_until <= now]
+                if len(ready) > 0:
+                    free = ready
+                    break
+                if len(free) > 0:
+                    # Wait for a slot on an unblocked node or for the earliest hint to expire
+                    timeout = min(self.nodes[n].blocked_until for n in free) - now
+                else:
+                    timeout = None
+                self.slots.wait(timeout)
+            if self.policy == 'random' or len(free) == 1:
+                node_num = choice(free)
+            elif self.policy == 'p2c':
+                node_num = min(sample(free, 2), key=self.get_score)
+            else:
+                best = min(self.get_score(n) for n in free)
+                node_num = choice([n for n in free if self.get_score(n) == best])
+            stats = self.nodes[node_num]
+            if stats.inflight == 0:
+                stats.busy_since = time()
+            stats.inflight += 1
+            return node_num
+
+    def release(self, node_num: int, num_processed: int, num_rejected: int, duration: float, retry_after: float = 0.0) -> None:
+        # Record the outcome of a call to a compute node which processed num_processed tasks in duration seconds
+        # and rejected num_rejected tasks, asking for no more tasks for retry_after seconds
+        with self.slots:
+            stats = self.nodes[node_num]
+            stats.inflight -= 1
+            if stats.inflight == 0:
+                stats.busy_time += time() - stats.busy_since
+            if retry_after > 0:
+                stats.blocked_until = max(stats.blocked_until, time() + retry_after)
+            stats.rejected += num_rejected
+            for rejected in [0] * num_processed + [1] * num_rejected:
+                stats.rejection_rate = (1 - self.alpha) * stats.rejection_rate + self.alpha * rejected
+            if num_processed > 0:
+                stats.processed += num_processed
+                service_time = duration / num_processed
+                if stats.processed == num_processed:
+                    stats.service_time = service_time
+                else:
+                    stats.service_time = (1 - self.alpha) * stats.service_time + self.alpha * service_time
+            self.slots.notify_all()
+
+    def get_batch_size(self, node_num: int, batch_duration: float, max_batch_size: int) -> int:
+        # Number of tasks the compute node is expected to accept and process in batch_duration seconds, starting from
+        # a single task until the node has processed one
+        stats = self.nodes[node_num]
+        if stats.service_time <= 0:
+            return 1
+        return max(1, min(max_batch_size, int(batch_duration / stats.service_time * (1 - stats.rejection_rate))))
+
+    def get_backoff(self, attempt: int) -> float:
+        # Exponential backoff with full jitter after the given number of consecutive rejections of a task
+        return random() * min(self.backoff_cap, self.backoff_base * (2 ** (attempt - 1)))
@@ -13,62 +13,576 @@ if PROJ_PATH is None:
     PROJ_PATH = '.'
 
 import time
-from threading import Thread
-from random import randrange
+from queue import Queue
+from collections import deque, OrderedDict
+from threading import Thread, Condition, Lock
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
 import json
 
 from gen.service import ComputeService, ServerService
-from gen.service.ttypes import Job, Task, TaskRejected
+from gen.service.ttypes import Job, Task, TaskRejected, TaskState, TaskResult, JobProgress, JobNotFound
 
 from thrift.transport import TSocket
 from thrift.transport import TTransport
 from thrift.protocol import TBinaryProtocol
 from thrift.server import TServer
 
-# Function to process a task on a seperate thread
-def process_task(data_dir: str, file_name: str, compute_nodes: list):
+from scheduler import SCHEDULING_POLICIES, LoadScheduler
+from payload import PAYLOAD_ENCODINGS, encode_payload, decode_payload
+from cache import ResultCache, get_cache_key
+from tiling import assemble_bands, decode_gray, read_image_size, remove_bands
+
+# "thread" starts a thread per file of each job, "pool" submits tasks through a persistent, bounded dispatcher
+DISPATCH_MODES = ['thread', 'pool']
+# "shared" lets compute nodes read and write images on a shared file system, "bytes" ships the images in the tasks
+DATA_SHIPPING_MODES = ['shared', 'bytes']
+
+# Function to get the host and port of the compute node with the given node number, where the port is 9091 plus the
+# node number unless its address in the "machine.txt" file ends with one, e.g. "localhost:9191"
+def get_compute_address(compute_nodes: list, node_num: int) -> tuple:
+    host, _, port = compute_nodes[node_num].rpartition(':')
+    if host == '':
+        return port, 9091 + node_num
+    return host, int(port)
+
+# Function to connect to the compute node with the given node number
+def connect_compute_node(compute_nodes: list, node_num: int):
+    transport = TSocket.TSocket(*get_compute_address(compute_nodes, node_num))
+    protocol = TBinaryProtocol.TBinaryProtocol(transport)
+    client = ComputeService.Client(protocol)
+    transport.open()
+    return client, transport
+
+# Function to submit a task to the compute nodes chosen by the scheduler until one of them processes it
+def submit_task(entry: 'TaskEntry', compute_nodes: list, scheduler: LoadScheduler, connections: dict) -> None:
+    task = entry.task
     while True:
-        # Select a random node number from [0, len(compute_nodes)]
-        node_num = randrange(len(compute_nodes))
-        # Connect to the compute node
-        transport = TSocket.TSocket(compute_nodes[node_num], 9091 + node_num)
-        protocol = TBinaryProtocol.TBinaryProtocol(transport)
-        client = ComputeService.Client(protocol)
-        transport.open()
-
-        # Submit the task
+        node_num = scheduler.acquire()
+        start = time.time()
+        duration = None
+        rejected = False
+        retry_after = 0.0
         try:
-            task = Task(data_dir, file_name)
+            # Reuse the connection to the compute node if there is one
+            if node_num not in connections:
+                connections[node_num] = connect_compute_node(compute_nodes, node_num)
+            client, _ = connections[node_num]
             client.process(task)
-            # Break from the loop if processed successfully, otherwise try again
-            break 
+            duration = time.time() - start
+            entry.tracker.finish_task(entry, TaskState.PROCESSED)
+            break
         except TaskRejected as e:
             print(f"[Server] Compute node {node_num} rejected the task.")
+            rejected = True
+            retry_after = e.retry_after or 0.0
+        except TTransport.TTransportException as e:
+            # Drop the connection and try again, possibly on another compute node
+            print(f"[Server] Lost the connection to compute node {node_num}: {e}")
+            if node_num in connections:
+                connections.pop(node_num)[1].close()
+        except Exception as e:
+            print(f"[Server] Failed to process \"{task.file_name}\" on compute node {node_num}: {e}")
+            entry.tracker.finish_task(entry, TaskState.FAILED, str(e))
+            break
+        finally:
+            # Only rejections count against the compute node, like in the dispatcher
+            if duration is None:
+                scheduler.release(node_num, 0, int(rejected), 0, retry_after)
+            else:
+                scheduler.release(node_num, 1, 0, duration)
+
+        # Back off before trying again so that busy compute nodes are not flooded with retries, unless the compute
+        # node told the scheduler when to try it again
+        entry.rejections += 1
+        if retry_after <= 0:
+            time.sleep(scheduler.get_backoff(entry.rejections))
+
+# Function to process a task on a seperate thread
+def process_task(entry: 'TaskEntry', compute_nodes: list, scheduler: LoadScheduler):
+    connections = {}
+    try:
+        if entry.split is not None and not entry.split.prepare(entry):
+            return
+        submit_task(entry, compute_nodes, scheduler, connections)
+    finally:
+        for _, transport in connections.values():
+            transport.close()
+
+class TaskEntry:
+    """
+    A task of a job on its way to the compute nodes, with the key of its result in the result cache once its image
+    has been read, the number of times compute nodes rejected it and the split image it is a band of, if any.
+    """
+    def __init__(self, task: Task, tracker: 'JobTracker', split: Optional['SplitImage'] = None):
+        self.task = task
+        self.tracker = tracker
+        self.split = split
+        self.key = None
+        self.rejections = 0
+        self.start = time.time()
+
+class SplitImage:
+    """
+    A very large image split into bands which are processed by separate tasks, possibly on different compute nodes.
+    Before its first band is submitted, the server decodes the image once into a grayscale file which every band
+    reads its own tiles from. The image finishes once all of its bands finish, with the rejections of its bands added
+    up and the largest peak memory among them and its decoding.
+    """
+    # Images are decoded by a single thread of their own, so that the server never holds more than one decoded image
+    # in memory and no worker waits for an image to be decoded
+    decoder = ThreadPoolExecutor(1)
+
+    def __init__(self, num_bands: int):
+        self.num_bands = num_bands
+        self.remaining = num_bands
+        self.failed = False
+        self.why = ''
+        self.rejections = 0
+        self.peak_memory = 0
+        self.lock = Lock()
+        self.decoding = None
+        self.error = None
+
+    def decode(self, task: Task) -> Future:
+        # Start decoding the image for all of its bands the first time one of them is about to be submitted, and
+        # return the future which is done once the image is decoded
+        with self.lock:
+            if self.decoding is None:
+                self.decoding = SplitImage.decoder.submit(self.decode_image, task)
+            return self.decoding
+
+    def decode_image(self, task: Task) -> None:
+        try:
+            peak_memory = decode_gray(os.path.join(task.data_dir, 'input_dir', task.file_name), os.path.join(task.data_dir, 'output_dir', task.file_name))
+            with self.lock:
+                self.peak_memory = max(self.peak_memory, peak_memory)
+        except Exception as e:
+            print(f"[Server] Failed to decode \"{task.file_name}\": {e}")
+            self.error = str(e)
+
+    def prepare(self, entry: 'TaskEntry') -> bool:
+        # Wait for the image to be decoded and return whether the band can be submitted, or finish the band as failed
+        # if the image could not be decoded
+        self.decode(entry.task).result()
+        if self.error is not None:
+            entry.tracker.finish_task(entry, TaskState.FAILED, self.error)
+            return False
+        return True
+
+    def finish_band(self, entry: TaskEntry, state: TaskState, why: str, peak_memory: int) -> bool:
+        # Return whether this was the last band of the image to finish
+        with self.lock:
+            self.remaining -= 1
+            self.rejections += entry.rejections
+            self.peak_memory = max(self.peak_memory, peak_memory)
+            if state != TaskState.PROCESSED and not self.failed:
+                self.failed = True
+                self.why = why
+            return self.remaining == 0
+
+class JobTracker:
+    """
+    Keeps the progress of a job: the files which have not been handed out as tasks yet, the tasks which have not
+    finished yet and the result of every finished task, in the order the tasks finished. Images whose decoded color
+    pixels take more than large_image_bytes are split into bands of about large_image_bytes of decoded pixels each,
+    and their results are assembled once all of their bands are processed.
+    """
+    def __init__(self, job_id: int, job: Job, large_image_bytes: int = 0):
+        self.job_id = job_id
+        self.job = job
+        self.large_image_bytes = large_image_bytes
+        # Tasks for the bands of a split image which have not been handed out yet
+        self.bands = deque()
+        self.start = time.time()
+        self.end = self.start if len(job.file_names) == 0 else None
+        self.next_file = 0
+        self.remaining = len(job.file_names)
+        self.results = []
+        self.cache_hits = 0
+        self.peak_memory = 0
+        self.finished = Condition()
+
+    def has_files(self) -> bool:
+        return len(self.bands) > 0 or self.next_file < len(self.job.file_names)
+
+    def take_task(self) -> TaskEntry:
+        # Not thread safe, so the dispatcher only calls it under its lock
+        if len(self.bands) > 0:
+            return self.bands.popleft()
+        file_name = self.job.file_names[self.next_file]
+        self.next_file += 1
+        if self.large_image_bytes > 0:
+            # The size of the image is read from its header, and images which cannot be read or are in a format
+            # without a known header are processed whole, so that the compute node reports a missing image
+            size = read_image_size(os.path.join(self.job.data_dir, 'input_dir', file_name))
+            num_bands = 1 if size is None else -(-size[0] * size[1] * 3 // self.large_image_bytes)
+            if num_bands > 1:
+                split = SplitImage(num_bands)
+                self.bands.extend(TaskEntry(Task(self.job.data_dir, file_name, band=band, num_bands=num_bands), self, split) for band in range(num_bands))
+                return self.bands.popleft()
+        return TaskEntry(Task(self.job.data_dir, file_name), self)
+
+    def finish_task(self, entry: TaskEntry, state: TaskState, why: str = '', cache_hit: bool = False, peak_memory: int = 0) -> None:
+        rejections = entry.rejections
+        if entry.split is not None:
+            # A split image only finishes with its last band, once the bands are assembled into its result
+            split = entry.split
+            if not split.finish_band(entry, state, why, peak_memory):
+                return
+            output_file = os.path.join(entry.task.data_dir, 'output_dir', entry.task.file_name)
+            rejections, peak_memory = split.rejections, split.peak_memory
+            if split.failed:
+                state, why = TaskState.FAILED, split.why
+                remove_bands(output_file, split.num_bands)
+            else:
+                try:
+                    assemble_bands(output_file, split.num_bands)
+                except Exception as e:
+                    print(f"[Server] Failed to assemble the bands of \"{entry.task.file_name}\": {e}")
+                    state, why = TaskState.FAILED, str(e)
+        result = TaskResult(entry.task.file_name, state, why, time.time() - entry.start, rejections, cache_hit, peak_memory)
+        with self.finished:
+            self.results.append(result)
+            self.cache_hits += int(cache_hit)
+            self.peak_memory = max(self.peak_memory, peak_memory)
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.end = time.time()
+            self.finished.notify_all()
+
+    def wait(self) -> None:
+        with self.finished:
+            while self.remaining > 0:
+                self.finished.wait()
+
+    def get_progress(self, offset: int, timeout: float = 0) -> JobProgress:
+        # Wait up to timeout seconds for results past offset, then return them
+        with self.finished:
+            deadline = time.time() + timeout
+            while len(self.results) <= offset and self.remaining > 0 and time.time() < deadline:
+                self.finished.wait(deadline - time.time())
+            elapsed = (self.end if self.end is not None else time.time()) - self.start
+            return JobProgress(self.job_id, self.remaining == 0, len(self.job.file_names), len(self.results), elapsed, self.results[offset:])
+
+class OutputWriter:
+    """
+    Single thread which writes the results shipped back by the compute nodes and the results found in the result
+    cache to the output directory, and adds new results to the result cache, so that the workers never wait on the
+    disk and never write at the same time. Results wait in a bounded queue, and a task only finishes once its
+    result is written.
+    """
+    def __init__(self, queue_size: int, result_cache: Optional[ResultCache]):
+        self.result_cache = result_cache
+        self.results = Queue(maxsize=queue_size)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, entry: TaskEntry, result: Optional[bytes], encoding: str, cache_hit: bool = False, peak_memory: int = 0) -> None:
+        # A result of None means that the compute node already wrote the result, so it only has to be cached, or
+        # that it wrote a band of a split image, which is assembled once all of its bands are written
+        self.results.put((entry, result, encoding, cache_hit, peak_memory))
 
-        transport.close()
+    def stop(self) -> None:
+        # Stop once every result queued so far is written
+        self.results.put(None)
+        self.thread.join()
+
+    def run(self) -> None:
+        while True:
+            item = self.results.get()
+            if item is None:
+                return
+            entry, result, encoding, cache_hit, peak_memory = item
+            if entry.split is not None:
+                entry.tracker.finish_task(entry, TaskState.PROCESSED, peak_memory=peak_memory)
+                continue
+            output_file = os.path.join(entry.task.data_dir, 'output_dir', entry.task.file_name)
+            try:
+                if result is None:
+                    with open(output_file, 'rb') as file:
+                        result = file.read()
+                else:
+                    result = decode_payload(result, encoding)
+                    with open(output_file, 'wb') as file:
+                        file.write(result)
+                if entry.key is not None and not cache_hit:
+                    self.result_cache.put(entry.key, result)
+            except Exception as e:
+                print(f"[Server] Failed to write \"{output_file}\": {e}")
+                entry.tracker.finish_task(entry, TaskState.FAILED, str(e))
+                continue
+            entry.tracker.finish_task(entry, TaskState.PROCESSED, cache_hit=cache_hit, peak_memory=peak_memory)
+
+class Dispatcher:
+    """
+    Persistent pool of worker threads which take tasks from the running jobs and submit them to the compute nodes in
+    batches. Workers take the tasks of the running jobs in turn, so that jobs share the compute nodes fairly no
+    matter how many files each has, and tasks are only created when a worker takes them, so the number of threads,
+    sockets and queued tasks stays the same no matter how large the jobs are. Each batch holds about as many tasks as
+    the chosen compute node is expected to process in batch_duration seconds. Tasks whose results are in the result
+    cache never reach a compute node.
+    """
+    def __init__(self, compute_nodes: list, scheduler: LoadScheduler, num_workers: int, queue_size: int, max_batch_size: int, batch_duration: float, data_shipping: str, payload_encoding: str, result_cache: Optional[ResultCache]):
+        self.compute_nodes = compute_nodes
+        self.scheduler = scheduler
+        self.max_batch_size = max_batch_size
+        self.batch_duration = batch_duration
+        self.data_shipping = data_shipping
+        self.payload_encoding = payload_encoding
+        self.result_cache = result_cache
+        # Jobs with files which have not been handed out as tasks yet, in the order they take turns
+        self.jobs = deque()
+        self.jobs_cv = Condition()
+        self.stopped = False
+        self.output_writer = OutputWriter(queue_size, result_cache)
+        self.workers = [Thread(target=self.run_worker, daemon=True) for _ in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def add_job(self, tracker: JobTracker) -> None:
+        if not tracker.has_files():
+            return
+        with self.jobs_cv:
+            self.jobs.append(tracker)
+            self.jobs_cv.notify_all()
+
+    def stop(self) -> None:
+        # Stop the workers once there are no tasks left, closing their connections to the compute nodes, and then
+        # the output writer
+        with self.jobs_cv:
+            self.stopped = True
+            self.jobs_cv.notify_all()
+        for worker in self.workers:
+            worker.join()
+        self.output_writer.stop()
+
+    def take_task(self, block: bool) -> Optional[TaskEntry]:
+        # Take the next task of the job whose turn it is, which then moves to the back of the line, or return None
+        # if there is none and the dispatcher is stopped
+        with self.jobs_cv:
+            while len(self.jobs) == 0:
+                if not block or self.stopped:
+                    return None
+                self.jobs_cv.wait()
+            tracker = self.jobs.popleft()
+            entry = tracker.take_task()
+            if tracker.has_files():
+                self.jobs.append(tracker)
+            return entry
+
+    def requeue(self, entry: TaskEntry) -> None:
+        # Hand out a band again once its image is decoded
+        tracker = entry.tracker
+        with self.jobs_cv:
+            tracker.bands.append(entry)
+            if tracker not in self.jobs:
+                self.jobs.append(tracker)
+            self.jobs_cv.notify_all()
+
+    def load_inputs(self, batch: list) -> list:
+        # Read the images of the tasks which have not been read yet to look up their results in the result cache and
+        # to attach them to the tasks when shipping images, and decode split images for their bands. Tasks whose
+        # images cannot be read fail, tasks whose results are cached finish once the output writer copies the
+        # results to the output directory, and bands whose images are still being decoded are handed out again once
+        # they are decoded.
+        loaded = []
+        for entry in batch:
+            task = entry.task
+            # Split images are neither cached nor shipped, only decoded once for all of their bands
+            if entry.split is not None:
+                decoding = entry.split.decode(task)
+                if not decoding.done():
+                    decoding.add_done_callback(lambda _, entry=entry: self.requeue(entry))
+                elif entry.split.prepare(entry):
+                    loaded.append(entry)
+                continue
+            if entry.key is not None or task.content is not None or (self.data_shipping == 'shared' and self.result_cache is None):
+                loaded.append(entry)
+                continue
+            try:
+                with open(os.path.join(task.data_dir, 'input_dir', task.file_name), 'rb') as file:
+                    content = file.read()
+            except OSError as e:
+                print(f"[Server] Failed to read \"{task.file_name}\": {e}")
+                entry.tracker.finish_task(entry, TaskState.FAILED, str(e))
+                continue
+            if self.result_cache is not None:
+                entry.key = get_cache_key(content, task.file_name)
+                result = self.result_cache.get(entry.key)
+                if result is not None:
+                    self.output_writer.write(entry, result, 'raw', cache_hit=True)
+                    continue
+            if self.data_shipping == 'bytes':
+                entry.task = Task(task.data_dir, task.file_name, encode_payload(content, self.payload_encoding), self.payload_encoding)
+            loaded.append(entry)
+        return loaded
+
+    def submit_batch(self, node_num: int, batch: list, connections: dict) -> tuple:
+        # Submit a batch of tasks to the compute node and return the tasks which have to be retried, along with the
+        # number of seconds after which the compute node asked to be tried again
+        start = time.time()
+        statuses = None
+        try:
+            # Reuse the connection to the compute node if there is one
+            if node_num not in connections:
+                connections[node_num] = connect_compute_node(self.compute_nodes, node_num)
+            client, _ = connections[node_num]
+            statuses = client.process_batch([entry.task for entry in batch])
+        except TTransport.TTransportException as e:
+            # Drop the connection and retry the whole batch, possibly on another compute node
+            print(f"[Server] Lost the connection to compute node {node_num}: {e}")
+            if node_num in connections:
+                connections.pop(node_num)[1].close()
+            return batch, 0.0
+        except Exception as e:
+            print(f"[Server] Failed to process a batch of {len(batch)} tasks on compute node {node_num}: {e}")
+            for entry in batch:
+                entry.tracker.finish_task(entry, TaskState.FAILED, str(e))
+            return [], 0.0
+        finally:
+            # Batches which could not be submitted say nothing about the load of the compute node
+            if statuses is None:
+                self.scheduler.release(node_num, 0, 0, 0)
+
+        retries = []
+        # The compute node has room again once the hint of the first rejected task expires
+        retry_after = None
+        num_processed = 0
+        for entry, status in zip(batch, statuses):
+            if status.state == TaskState.REJECTED:
+                entry.rejections += 1
+                retries.append(entry)
+                if retry_after is None:
+                    retry_after = status.retry_after or 0.0
+                continue
+            if status.state == TaskState.PROCESSED:
+                num_processed += 1
+                if status.result is not None or entry.key is not None or entry.split is not None:
+                    # The output writer finishes the task once the result is written and cached, or once the bands
+                    # of its image are assembled
+                    self.output_writer.write(entry, status.result, entry.task.encoding, peak_memory=status.peak_memory or 0)
+                    continue
+            else:
+                print(f"[Server] Failed to process \"{entry.task.file_name}\" on compute node {node_num}: {status.why}")
+            entry.tracker.finish_task(entry, status.state, status.why, peak_memory=status.peak_memory or 0)
+        if len(retries) > 0:
+            print(f"[Server] Compute node {node_num} rejected {len(retries)} of {len(batch)} tasks.")
+        retry_after = retry_after or 0.0
+        # Only rejections count against the compute node, tasks which failed on it say nothing about its load
+        self.scheduler.release(node_num, num_processed, len(retries), time.time() - start, retry_after)
+        return retries, retry_after
+
+    def run_worker(self) -> None:
+        # Each worker keeps its connections to the compute nodes open between batches until the dispatcher stops
+        connections = {}
+        try:
+            self.dispatch(connections)
+        finally:
+            for _, transport in connections.values():
+                transport.close()
+
+    def dispatch(self, connections: dict) -> None:
+        # Tasks taken from the jobs which have not been processed yet, e.g. because a compute node rejected them
+        pending = []
+        attempt = 0
+        while True:
+            if len(pending) == 0:
+                entry = self.take_task(True)
+                if entry is None:
+                    return
+                pending.append(entry)
+            # Look up the results in the result cache and start decoding split images before choosing a compute node, so
+            # that tasks whose results are cached and bands whose images are not decoded yet never hold a compute node
+            pending = self.load_inputs(pending)
+            if len(pending) == 0:
+                continue
+            node_num = self.scheduler.acquire()
+            # Fill the batch without waiting for more jobs to arrive, where cached results do not take up room in it
+            batch_size = self.scheduler.get_batch_size(node_num, self.batch_duration, self.max_batch_size)
+            while len(pending) < batch_size:
+                entry = self.take_task(False)
+                if entry is None:
+                    break
+                pending.extend(self.load_inputs([entry]))
+            batch, pending = pending[:batch_size], pending[batch_size:]
+            retries, retry_after = self.submit_batch(node_num, batch, connections)
+            pending = retries + pending
+
+            # Back off before trying the rejected tasks again so that busy compute nodes are not flooded with retries,
+            # unless the compute node told the scheduler when to try it again
+            if len(retries) > 0 and retry_after <= 0:
+                attempt += 1
+                time.sleep(self.scheduler.get_backoff(attempt))
+            else:
+                attempt = 0
 
 class ServerHandler:
-    def __init__(self, compute_nodes: list):
+    def __init__(self, compute_nodes: list, dispatch_mode: str = 'pool', max_inflight: int = 4, queue_size: int = 128, scheduling_policy: str = 'p2c', backoff_base: float = 0.05, backoff_cap: float = 2.0, max_batch_size: int = 32, batch_duration: float = 0.25, data_shipping: str = 'shared', payload_encoding: str = 'raw', result_cache: Optional[ResultCache] = None, finished_jobs: int = 100, large_image_bytes: int = 0):
         self.compute_nodes = compute_nodes
-    
+        self.dispatch_mode = dispatch_mode
+        self.dispatcher = None
+        if dispatch_mode == 'pool':
+            # Each compute node runs at most max_inflight tasks at a time, one for each of its workers
+            self.scheduler = LoadScheduler(len(compute_nodes), scheduling_policy, max_inflight, backoff_base=backoff_base, backoff_cap=backoff_cap)
+            self.dispatcher = Dispatcher(compute_nodes, self.scheduler, len(compute_nodes) * max_inflight, queue_size, max_batch_size, batch_duration, data_shipping, payload_encoding, result_cache)
+        else:
+            self.scheduler = LoadScheduler(len(compute_nodes), scheduling_policy, backoff_base=backoff_base, backoff_cap=backoff_cap)
+        # Jobs by job id, where only the last finished_jobs submitted jobs are kept once they finish
+        self.jobs = OrderedDict()
+        self.jobs_lock = Lock()
+        self.next_job_id = 1
+        self.finished_jobs = finished_jobs
+        # Images are only split when the compute nodes can write their bands to the shared file system
+        self.large_image_bytes = large_image_bytes if data_shipping == 'shared' else 0
+
+    def shutdown(self) -> None:
+        # Stop the dispatcher once every submitted job is processed, e.g. before the handler is replaced
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+
+    def get_job(self, job_id: int) -> JobTracker:
+        with self.jobs_lock:
+            if job_id not in self.jobs:
+                raise JobNotFound(job_id)
+            return self.jobs[job_id]
+
+    def submit_job(self, job: Job) -> int:
+        with self.jobs_lock:
+            job_id = self.next_job_id
+            self.next_job_id += 1
+            tracker = self.jobs[job_id] = JobTracker(job_id, job, self.large_image_bytes)
+            # Forget the oldest finished jobs
+            finished = [finished_id for finished_id, finished_tracker in self.jobs.items() if finished_tracker.remaining == 0]
+            for finished_id in finished[:max(0, len(finished) - self.finished_jobs)]:
+                del self.jobs[finished_id]
+        print(f"[Server] Recieved job {job_id} to process images [{', '.join(job.file_names)}] in the directory: {job.data_dir}")
+
+        if self.dispatch_mode == 'pool':
+            self.dispatcher.add_job(tracker)
+        else:
+            # Start a thread to process each file name in the job
+            while tracker.has_files():
+                Thread(target=process_task, args=[tracker.take_task(), self.compute_nodes, self.scheduler]).start()
+        return job_id
+
+    def poll_job(self, job_id: int, offset: int) -> JobProgress:
+        return self.get_job(job_id).get_progress(offset)
+
+    def stream_results(self, job_id: int, offset: int, timeout: float) -> JobProgress:
+        # Thrift has no streaming responses, so clients stream results by calling this repeatedly with the number
+        # of results they already have, and each call waits until there are new results or the job finishes
+        return self.get_job(job_id).get_progress(offset, timeout)
+
     def process(self, job: Job) -> float:
-        print(f"[Server] Recieved job to process images [{', '.join(job.file_names)}] in the directory: {job.data_dir}")
+        job_id = self.submit_job(job)
+        tracker = self.get_job(job_id)
+        tracker.wait()
+        with self.jobs_lock:
+            self.jobs.pop(job_id, None)
 
-        start = time.time()
-        threads = []
-        # Start a thread to process each file name in the job
-        for file_name in job.file_names:
-            thread = Thread(target=process_task, args=[job.data_dir, file_name, self.compute_nodes])
-            thread.start()
-            threads.append(thread)
-
-        # Join on all the threads
-        for thread in threads:
-            thread.join()
-
-        end = time.time()
-        duration = end - start
-        print(f"[Server] Finished processing job in {duration} seconds.")
+        duration = tracker.end - tracker.start
+        print(f"[Server] Finished processing job {job_id} in {duration} seconds with {tracker.cache_hits} of {len(job.file_names)} results found in the result cache and a peak memory of {tracker.peak_memory} bytes for a single task.")
         # Return the time it took to process the job back to the client
         return duration
 
@@ -84,17 +598,54 @@ def get_compute_nodes() -> list:
                 compute_nodes.append(parts[1])
     return compute_nodes
 
+# Function to load the server config options from the "config.json" file
+def load_server_config() -> dict:
+    config = {}
+    config_file = os.path.join(PROJ_PATH, 'config.json')
+    if os.path.exists(config_file):
+        with open(config_file) as json_file:
+            config = json.load(json_file)
+            config = config.get('server', {})
+    return config
+
 
 if __name__ == '__main__':
     # Get the addresses of the compute nodes
     compute_nodes = get_compute_nodes()
+    server_config = load_server_config()
+    dispatch_mode = server_config.get('dispatch_mode', 'pool')
+    max_inflight = server_config.get('max_inflight_per_node', 4)
+    queue_size = server_config.get('queue_size', 128)
+    scheduling_policy = server_config.get('scheduling_policy', 'p2c')
+    backoff_base = server_config.get('backoff_base', 0.05)
+    backoff_cap = server_config.get('backoff_cap', 2.0)
+    max_batch_size = server_config.get('max_batch_size', 32)
+    batch_duration = server_config.get('batch_duration', 0.25)
+    data_shipping = server_config.get('data_shipping', 'shared')
+    payload_encoding = server_config.get('payload_encoding', 'raw')
+    result_cache_dir = server_config.get('result_cache_dir', os.path.join(PROJ_PATH, '.result_cache'))
+    result_cache_bytes = server_config.get('result_cache_bytes', 0)
+    finished_jobs = server_config.get('finished_jobs', 100)
+    large_image_bytes = server_config.get('large_image_bytes', 67108864)
 
     if len(compute_nodes) == 0:
         print('[Server] No compute nodes were provided in the \"machine.txt\" file, exiting...')
+    elif dispatch_mode not in DISPATCH_MODES:
+        print(f"[Server] Unknown dispatch mode \"{dispatch_mode}\", expected one of {DISPATCH_MODES}, exiting...")
+    elif scheduling_policy not in SCHEDULING_POLICIES:
+        print(f"[Server] Unknown scheduling policy \"{scheduling_policy}\", expected one of {SCHEDULING_POLICIES}, exiting...")
+    elif data_shipping not in DATA_SHIPPING_MODES or payload_encoding not in PAYLOAD_ENCODINGS:
+        print(f"[Server] Unknown data shipping mode \"{data_shipping}\" or payload encoding \"{payload_encoding}\", expected one of {DATA_SHIPPING_MODES} and one of {PAYLOAD_ENCODINGS}, exiting...")
+    elif data_shipping == 'bytes' and dispatch_mode != 'pool':
+        print('[Server] Shipping images in the tasks requires the \"pool\" dispatch mode, exiting...')
     else:
-        print(f"[Server] Initializing server handler.")
+        print(f"[Server] Initializing server handler with the \"{dispatch_mode}\" dispatch mode and the \"{scheduling_policy}\" scheduling policy.")
+        # The result cache is only used in the "pool" dispatch mode and a size of 0 disables it
+        result_cache = None
+        if dispatch_mode == 'pool' and result_cache_bytes > 0:
+            result_cache = ResultCache(result_cache_dir, result_cache_bytes)
         # Initialize the server handler
-        handler = ServerHandler(compute_nodes)
+        handler = ServerHandler(compute_nodes, dispatch_mode, max_inflight, queue_size, scheduling_policy, backoff_base, backoff_cap, max_batch_size, batch_duration, data_shipping, payload_encoding, result_cache, finished_jobs, large_image_bytes)
         processor = ServerService.Processor(handler)
         transport = TSocket.TServerSocket(port=9090)
         tfactory = TTransport.TBufferedTransportFactory()
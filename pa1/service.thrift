@@ -1,10 +1,34 @@
 exception TaskRejected {
-    1: string why
+    1: string why;
+    2: double retry_after;
+}
+
+exception JobNotFound {
+    1: i64 job_id
 }
 
 struct Task {
     1: string data_dir;
     2: string file_name;
+    3: optional binary content;
+    4: optional string encoding;
+    5: optional i32 band;
+    6: optional i32 num_bands;
+}
+
+enum TaskState {
+    PROCESSED = 1,
+    REJECTED = 2,
+    FAILED = 3
+}
+
+struct TaskStatus {
+    1: TaskState state;
+    2: string why;
+    3: double duration;
+    4: optional binary result;
+    5: double retry_after;
+    6: i64 peak_memory;
 }
 
 struct Job {
@@ -12,10 +36,33 @@ struct Job {
     2: list<string> file_names;
 }
 
+struct TaskResult {
+    1: string file_name;
+    2: TaskState state;
+    3: string why;
+    4: double duration;
+    5: i32 rejections;
+    6: bool cache_hit;
+    7: i64 peak_memory;
+}
+
+struct JobProgress {
+    1: i64 job_id;
+    2: bool finished;
+    3: i32 num_tasks;
+    4: i32 num_finished;
+    5: double elapsed;
+    6: list<TaskResult> results;
+}
+
 service ServerService {
     double process(1:Job job)
+    i64 submit_job(1:Job job)
+    JobProgress poll_job(1:i64 job_id, 2:i32 offset) throws (1:JobNotFound error)
+    JobProgress stream_results(1:i64 job_id, 2:i32 offset, 3:double timeout) throws (1:JobNotFound error)
 }
 
 service ComputeService {
     void process(1:Task task) throws (1:TaskRejected error)
+    list<TaskStatus> process_batch(1:list<Task> tasks)
 }
\ No newline at end of file
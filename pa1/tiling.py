@@ -0,0 +1,122 @@
+import os
+import struct
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from cache import CANNY_THRESHOLDS
+
+# Start of frame markers of JPEG files, which are followed by the height and the width of the image
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Function to read the height and width of a PNG, JPEG or BMP image from its header without decoding it, or None if
+# the image cannot be read or is in another format
+def read_image_size(input_file: str) -> Optional[tuple]:
+    try:
+        with open(input_file, 'rb') as file:
+            header = file.read(26)
+            if header.startswith(b'\x89PNG\r\n\x1a\n') and header[12:16] == b'IHDR':
+                width, height = struct.unpack('>II', header[16:24])
+                return height, width
+            if header.startswith(b'BM') and len(header) >= 26:
+                width, height = struct.unpack('<ii', header[18:26])
+                return abs(height), width
+            if not header.startswith(b'\xff\xd8'):
+                return None
+            # Walk the segments of the JPEG file up to its start of frame
+            file.seek(2)
+            while True:
+                marker = file.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] == 0xFF:
+                    # Padding before the next marker
+                    file.seek(-1, os.SEEK_CUR)
+                    continue
+                if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD8:
+                    continue
+                segment = file.read(7)
+                if len(segment) < 7 or marker[1] == 0xDA:
+                    return None
+                length = struct.unpack('>H', segment[:2])[0]
+                if marker[1] in JPEG_SOF_MARKERS:
+                    height, width = struct.unpack('>HH', segment[3:7])
+                    return height, width
+                file.seek(length - 7, os.SEEK_CUR)
+    except OSError as _:
+        return None
+
+# Function to get the first row and the row after the last of a band of an image split into num_bands bands
+def get_band_rows(height: int, band: int, num_bands: int) -> tuple:
+    return height * band // num_bands, height * (band + 1) // num_bands
+
+# Function to get the file a compute node writes the edges of a band of an image to, next to its output file
+def get_band_file(output_file: str, band: int) -> str:
+    return f'{output_file}.band{band}.npy'
+
+# Function to get the file the grayscale image of a split image is decoded to, next to its output file
+def get_gray_file(output_file: str) -> str:
+    return f'{output_file}.gray.npy'
+
+# Function to decode an image once for all of its bands into its grayscale file, which the bands read their tiles
+# from. The image is decoded straight to grayscale, so its color pixels are never held in memory, at the cost of
+# gray levels which may differ slightly from those of an image which is decoded in color and converted.
+# Returns the largest number of bytes held at once.
+def decode_gray(input_file: str, output_file: str) -> int:
+    img = cv2.imread(filename=input_file, flags=cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise IOError(f"Could not read the image \"{input_file}\"")
+    gray = np.lib.format.open_memmap(get_gray_file(output_file), mode='w+', dtype=np.uint8, shape=img.shape[:2])
+    gray[:] = img
+    gray.flush()
+    return img.nbytes
+
+# Function to detect the edges of a band of a grayscale image one tile at a time and stream them to the band file.
+# The grayscale image is usually memory-mapped, so only the tiles of the band are ever read into memory.
+# Each tile is processed with tile_margin extra rows and columns on every side which are then cropped, so that the
+# gradients and the non-maximum suppression at the borders of the tiles see the same pixels as they would in the
+# whole image, and so that hysteresis follows weak edges across the borders of the tiles for tile_margin pixels.
+# Returns the largest number of bytes held for a single tile and its edges.
+def detect_band_edges(gray: np.ndarray, output_file: str, band: int, num_bands: int, tile_size: int, tile_margin: int) -> int:
+    height, width = gray.shape[:2]
+    start, stop = get_band_rows(height, band, num_bands)
+    # The band is written to a memory-mapped file, so the edges of the whole band are never held in memory
+    edges = np.lib.format.open_memmap(get_band_file(output_file, band), mode='w+', dtype=np.uint8, shape=(stop - start, width))
+    peak_bytes = 0
+    for top in range(start, stop, tile_size):
+        bottom = min(stop, top + tile_size)
+        for left in range(0, width, tile_size):
+            right = min(width, left + tile_size)
+            tile_top, tile_left = max(0, top - tile_margin), max(0, left - tile_margin)
+            tile = np.ascontiguousarray(gray[tile_top:min(height, bottom + tile_margin), tile_left:min(width, right + tile_margin)])
+            tile_edges = cv2.Canny(image=tile, threshold1=CANNY_THRESHOLDS[0], threshold2=CANNY_THRESHOLDS[1])
+            edges[top - start:bottom - start, left:right] = tile_edges[top - tile_top:bottom - tile_top, left - tile_left:right - tile_left]
+            peak_bytes = max(peak_bytes, tile.nbytes + tile_edges.nbytes)
+    edges.flush()
+    return peak_bytes
+
+# Function to stack the band files of an image into its edges and write them to the output file
+def assemble_bands(output_file: str, num_bands: int) -> None:
+    band_files = [get_band_file(output_file, band) for band in range(num_bands)]
+    edges_file = f'{output_file}.edges.npy'
+    try:
+        bands = [np.load(band_file, mmap_mode='r') for band_file in band_files]
+        # Copy the bands into a single memory-mapped file, since OpenCV encodes images from a single array
+        edges = np.lib.format.open_memmap(edges_file, mode='w+', dtype=np.uint8, shape=(sum(len(edges) for edges in bands), bands[0].shape[1]))
+        row = 0
+        for band_edges in bands:
+            edges[row:row + len(band_edges)] = band_edges
+            row += len(band_edges)
+        if not cv2.imwrite(filename=output_file, img=edges):
+            raise IOError(f"Could not write the image \"{output_file}\"")
+    finally:
+        remove_bands(output_file, num_bands)
+        if os.path.exists(edges_file):
+            os.remove(edges_file)
+
+# Function to remove the grayscale file and the band files of an image which were written so far
+def remove_bands(output_file: str, num_bands: int) -> None:
+    for band_file in [get_gray_file(output_file)] + [get_band_file(output_file, band) for band in range(num_bands)]:
+        if os.path.exists(band_file):
+            os.remove(band_file)
@@ -0,0 +1,68 @@
+import time
+import hashlib
+from threading import Lock
+from typing import Dict, List, Tuple
+
+# Number of buckets the version table of a shard is split into when comparing replicas
+NUM_BUCKETS = 256
+
+
+def get_bucket(file_name: str, num_buckets: int) -> int:
+    # Uses a different hash than get_shard so that the files of a single shard spread over every bucket
+    digest = hashlib.blake2b(file_name.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % num_buckets
+
+
+def file_digest(file_name: str, version: int) -> int:
+    digest = hashlib.blake2b(f'{version} {file_name}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def bucket_digests(files: List[Tuple[str, int]], num_buckets: int) -> List[int]:
+    """
+    Summarizes a version table as one digest per bucket, the XOR of the digests of every (file name,
+    version) pair in the bucket. Two replicas hold the same versions of the files in a bucket exactly
+    when (barring hash collisions) their digests for the bucket are equal, so only the buckets whose
+    digests differ have to be listed and compared file by file.
+    """
+    digests = [0] * num_buckets
+    for file_name, version in files:
+        digests[get_bucket(file_name, num_buckets)] ^= file_digest(file_name, version)
+    return digests
+
+
+def find_stale(listings: Dict[Tuple[str, int], Dict[str, int]]) -> List[Tuple[str, int, Tuple[str, int], List[Tuple[str, int]]]]:
+    # Returns (file name, latest version, server holding it, servers with an older version) for every out of date file
+    file_names = sorted(set().union(*listings.values()))
+    stale = []
+    for file_name in file_names:
+        source = max(listings, key=lambda server: listings[server].get(file_name, 0))
+        version = listings[source][file_name]
+        targets = [server for server, files in listings.items() if files.get(file_name, 0) < version]
+        stale.append((file_name, version, source, targets))
+    return [s for s in stale if len(s[3]) > 0]
+
+
+class TokenBucket:
+    """
+    Limits the rate at which bytes are sent, allowing bursts of up to "capacity" bytes.
+    """
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0:
+            raise ValueError(f'The rate must be positive, got {rate}.')
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = Lock()
+
+    def consume(self, amount: int) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # Go into debt instead of rejecting requests larger than the capacity, later callers wait it off
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
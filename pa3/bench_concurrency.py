@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+import argparse
+from threading import Thread, Event
+from typing import List
+
+from cluster import make_config, start_cluster, stop_cluster
+from benchmark import connect_server, run_workload
+
+# Compares the throughput and the number of server threads of the "threaded" and "pool" server modes as the number of clients grows
+
+def count_threads(pids: List[int]) -> int:
+    # Reads the number of threads of every process from /proc, which is only available on Linux
+    total = 0
+    for pid in pids:
+        with open(f'/proc/{pid}/status') as file:
+            for line in file:
+                if line.startswith('Threads:'):
+                    total += int(line.split()[1])
+    return total
+
+def sample_threads(pids: List[int], stop: Event, peak: List[int]) -> None:
+    while not stop.is_set():
+        peak[0] = max(peak[0], count_threads(pids))
+        stop.wait(0.05)
+
+if __name__ == '__main__':
+    client_counts = [int(c) for c in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1, 4, 16, 64]
+    num_ops = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    output_file = sys.argv[3] if len(sys.argv) > 3 else 'concurrency.csv'
+    num_servers = 7
+    num_files = 100
+    read_ratio = 0.5
+
+    rows = ['server_mode,clients,ops,throughput,p50,p99,peak_threads']
+    for server_mode in ['threaded', 'pool']:
+        for num_clients in client_counts:
+            with tempfile.TemporaryDirectory() as storage_path:
+                config = make_config(storage_path, num_servers, 1, 4, 4, server_mode=server_mode)
+                config_file = os.path.join(storage_path, 'config.json')
+                processes = start_cluster(config, config_file)
+                try:
+                    servers = [(s['host'], s['port']) for s in config['servers']]
+                    client, transport = connect_server(*servers[0])
+                    transport.open()
+                    for i in range(num_files):
+                        client.write(f'{i}.txt', 'x' * 100)
+                    transport.close()
+                    stop = Event()
+                    peak = [0]
+                    sampler = Thread(target=sample_threads, args=([p.pid for p in processes], stop, peak))
+                    sampler.start()
+                    args = argparse.Namespace(files=num_files, distribution='uniform', zipf_s=1.1, threads=num_clients, ops=num_ops)
+                    results = run_workload(servers, args, read_ratio, ['x' * 100])
+                    stop.set()
+                    sampler.join()
+                finally:
+                    stop_cluster(processes)
+            _, count, throughput, p50, p99 = results[-1]
+            print(f'[Benchmark] {server_mode} server mode with {num_clients} clients: {throughput:.1f} ops/sec, p99 {p99 * 1000:.2f} ms, {peak[0]} threads at peak.')
+            rows.append(f'{server_mode},{num_clients},{count},{throughput},{p50},{p99},{peak[0]}')
+    with open(output_file, 'w') as file:
+        file.write('\n'.join(rows) + '\n')
@@ -0,0 +1,37 @@
+import os
+import sys
+import time
+import tempfile
+from threading import Thread
+
+from storage import FileStore, DURABILITY_LEVELS
+
+# Measures the write throughput of a replica's file store under each durability level
+if __name__ == '__main__':
+    num_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    num_writes = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    file_size = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    output_file = sys.argv[4] if len(sys.argv) > 4 else 'durability.csv'
+
+    def run_writer(store: FileStore, writer_num: int, writes: int):
+        data = os.urandom(file_size)
+        for i in range(writes):
+            store.put(f'{writer_num}-{i % 100}.txt', i + 1, data)
+
+    rows = ['durability,threads,writes,file_size,seconds,throughput']
+    for durability in DURABILITY_LEVELS:
+        with tempfile.TemporaryDirectory(dir='.') as storage_path:
+            store = FileStore(storage_path, durability)
+            writes_per_thread = num_writes // num_threads
+            threads = [Thread(target=run_writer, args=(store, i, writes_per_thread)) for i in range(num_threads)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            duration = time.time() - start
+            throughput = writes_per_thread * num_threads / duration
+            print(f'[Benchmark] Durability "{durability}": {writes_per_thread * num_threads} writes in {duration:.3f} seconds ({throughput:.1f} writes/sec).')
+            rows.append(f'{durability},{num_threads},{writes_per_thread * num_threads},{file_size},{duration},{throughput}')
+    with open(output_file, 'w') as file:
+        file.write('\n'.join(rows) + '\n')
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+from argparse import Namespace
+
+from cluster import make_config, start_cluster, stop_cluster
+from benchmark import run_workload
+
+# Compares the read and write latency of random and latency-aware quorum selection when some servers are slow
+
+if __name__ == '__main__':
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    num_ops = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    output_file = sys.argv[3] if len(sys.argv) > 3 else 'latency.csv'
+    num_servers = 7
+    num_files = 100
+    read_ratio = 0.5
+    # Two of the seven servers answer every replica RPC 20 ms late
+    delays = [0, 0, 0, 0, 0, 0.02, 0.02]
+
+    # Every client thread reads and writes files chosen uniformly, with the same contents for every write
+    args = Namespace(threads=num_clients, ops=num_ops, files=num_files, distribution='uniform', zipf_s=0)
+    contents = ['x' * 100]
+
+    rows = ['policy,op,count,p50,p99']
+    for policy in ['random', 'latency']:
+        with tempfile.TemporaryDirectory() as storage_path:
+            config = make_config(storage_path, num_servers, 1, 3, 5, delays=delays, quorum_selection=policy)
+            config_file = os.path.join(storage_path, 'config.json')
+            processes = start_cluster(config, config_file)
+            try:
+                servers = [(s['host'], s['port']) for s in config['servers']]
+                results = run_workload(servers, args, read_ratio, contents)
+            finally:
+                stop_cluster(processes)
+        for op, count, _, p50, p99 in results:
+            if op == 'all':
+                continue
+            print(f'[Benchmark] {policy} quorum selection, {op}: p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms over {count} operations.')
+            rows.append(f'{policy},{op},{count},{p50},{p99}')
+    with open(output_file, 'w') as file:
+        file.write('\n'.join(rows) + '\n')
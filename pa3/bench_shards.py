@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+from argparse import Namespace
+
+from cluster import make_config, start_cluster, stop_cluster
+from benchmark import run_workload
+
+# Measures the throughput of a local cluster with 1, 2 and 4 coordinators under a mixed workload
+
+if __name__ == '__main__':
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    num_ops = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    output_file = sys.argv[3] if len(sys.argv) > 3 else 'shards.csv'
+    num_servers = 7
+    num_files = 100
+    read_ratio = 0.5
+
+    # Every client thread reads and writes files chosen uniformly, with the same contents for every write
+    args = Namespace(threads=num_clients, ops=num_ops, files=num_files, distribution='uniform', zipf_s=0)
+    contents = ['x' * 100]
+
+    rows = ['coordinators,clients,ops,seconds,throughput']
+    for num_coordinators in [1, 2, 4]:
+        with tempfile.TemporaryDirectory() as storage_path:
+            config = make_config(storage_path, num_servers, num_coordinators, 4, 4)
+            config_file = os.path.join(storage_path, 'config.json')
+            processes = start_cluster(config, config_file)
+            try:
+                servers = [(s['host'], s['port']) for s in config['servers']]
+                results = run_workload(servers, args, read_ratio, contents)
+            finally:
+                stop_cluster(processes)
+        # The last row of the results covers every operation
+        _, count, throughput, _, _ = results[-1]
+        duration = count / throughput
+        print(f'[Benchmark] {num_coordinators} coordinator(s): {num_clients * num_ops} operations in {duration:.3f} seconds ({throughput:.1f} ops/sec).')
+        rows.append(f'{num_coordinators},{num_clients},{num_clients * num_ops},{duration},{throughput}')
+    with open(output_file, 'w') as file:
+        file.write('\n'.join(rows) + '\n')
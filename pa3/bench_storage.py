@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+import random
+import tempfile
+from threading import Thread
+
+from storage import STORAGE_ENGINES, open_store
+
+# Compares the small file write and read throughput of the flat and packed storage engines
+if __name__ == '__main__':
+    num_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    num_files = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    file_size = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    output_file = sys.argv[4] if len(sys.argv) > 4 else 'storage.csv'
+    durability = sys.argv[5] if len(sys.argv) > 5 else 'group'
+
+    def run_writer(store, writer_num: int, files: int):
+        data = os.urandom(file_size)
+        for i in range(files):
+            store.put(f'{writer_num}-{i}.txt', 1, data)
+
+    def run_reader(store, reads: int, files_per_thread: int):
+        for _ in range(reads):
+            store.read(f'{random.randrange(num_threads)}-{random.randrange(files_per_thread)}.txt', 0, 0, -1)
+
+    def run_threads(target, args) -> float:
+        threads = [Thread(target=target, args=args(i)) for i in range(num_threads)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+    rows = ['engine,durability,threads,files,file_size,op,seconds,throughput']
+    for engine in STORAGE_ENGINES:
+        with tempfile.TemporaryDirectory(dir='.') as storage_path:
+            store = open_store(storage_path, engine, durability, 1.0, 64 << 20)
+            files_per_thread = num_files // num_threads
+            total = files_per_thread * num_threads
+            results = [('write', run_threads(run_writer, lambda i: (store, i, files_per_thread)))]
+            results.append(('read', run_threads(run_reader, lambda i: (store, files_per_thread, files_per_thread))))
+            for op, duration in results:
+                throughput = total / duration
+                print(f'[Benchmark] Storage engine "{engine}": {total} {op}s in {duration:.3f} seconds ({throughput:.1f} {op}s/sec).')
+                rows.append(f'{engine},{durability},{num_threads},{total},{file_size},{op},{duration},{throughput}')
+    with open(output_file, 'w') as file:
+        file.write('\n'.join(rows) + '\n')
@@ -0,0 +1,142 @@
+import os
+import time
+import random
+import string
+import argparse
+import tempfile
+from itertools import accumulate
+from threading import Thread
+from typing import Dict, List, Tuple
+
+from thrift.transport import TSocket
+from thrift.protocol import TBinaryProtocol
+
+from gen.service import ServerService
+from gen.service.ttypes import FileNotFound
+
+from cluster import make_config, start_cluster, stop_cluster
+
+# Runs read/write workloads against a local cluster for several quorum sizes and reports throughput and latency percentiles
+
+WORKLOADS = {'read_heavy': 0.8, 'mixed': 0.5, 'write_heavy': 0.2}
+
+
+def connect_server(host: str, port: int):
+    transport = TSocket.TSocket(host, port)
+    protocol = TBinaryProtocol.TBinaryProtocol(transport)
+    client = ServerService.Client(protocol)
+    return client, transport
+
+
+def get_quorums(num_servers: int) -> List[Tuple[int, int]]:
+    # Every valid write quorum (a majority of the servers) with the smallest read quorum overlapping it, e.g.
+    # (4, 4), (3, 5), (2, 6), (1, 7) for 7 servers
+    return [(num_servers - q_write + 1, q_write) for q_write in range(num_servers // 2 + 1, num_servers + 1)]
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if len(samples) == 0:
+        return 0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+class FileChooser:
+    """
+    Picks file indices either uniformly or from a Zipfian distribution where the file with rank k
+    is chosen with probability proportional to 1 / k^s.
+    """
+    def __init__(self, num_files: int, distribution: str, s: float):
+        self.num_files = num_files
+        self.cum_weights = None
+        if distribution == 'zipf':
+            self.cum_weights = list(accumulate(1 / (k ** s) for k in range(1, num_files + 1)))
+
+    def choose(self) -> int:
+        if self.cum_weights is None:
+            return random.randrange(self.num_files)
+        return random.choices(range(self.num_files), cum_weights=self.cum_weights)[0]
+
+
+def run_client(servers: List, num_ops: int, chooser: FileChooser, read_ratio: float, contents: List[str], latencies: Dict[str, List[float]]) -> None:
+    host, port = random.choice(servers)
+    client, transport = connect_server(host, port)
+    transport.open()
+    try:
+        for _ in range(num_ops):
+            file_name = f'{chooser.choose()}.txt'
+            if random.random() < read_ratio:
+                start = time.perf_counter()
+                try:
+                    client.read(file_name)
+                except FileNotFound as _:
+                    pass
+                latencies['read'].append(time.perf_counter() - start)
+            else:
+                content = random.choice(contents)
+                start = time.perf_counter()
+                client.write(file_name, content)
+                latencies['write'].append(time.perf_counter() - start)
+    finally:
+        transport.close()
+
+
+def run_workload(servers: List, args: argparse.Namespace, read_ratio: float, contents: List[str]) -> List[tuple]:
+    chooser = FileChooser(args.files, args.distribution, args.zipf_s)
+    results = [{'read': [], 'write': []} for _ in range(args.threads)]
+    threads = [Thread(target=run_client, args=(servers, args.ops, chooser, read_ratio, contents, results[i])) for i in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    latencies = {op: [latency for result in results for latency in result[op]] for op in ['read', 'write']}
+    latencies['all'] = latencies['read'] + latencies['write']
+    return [(op, len(samples), len(samples) / duration, percentile(samples, 0.5), percentile(samples, 0.99)) for op, samples in latencies.items()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a local cluster for several quorum sizes.')
+    parser.add_argument('--servers', type=int, default=7, help='number of servers in the cluster')
+    parser.add_argument('--coordinators', type=int, default=1, help='number of coordinators in the cluster')
+    parser.add_argument('--threads', type=int, default=8, help='number of concurrent client threads')
+    parser.add_argument('--ops', type=int, default=200, help='number of operations per client thread')
+    parser.add_argument('--files', type=int, default=100, help='number of distinct files')
+    parser.add_argument('--file-size', type=int, default=100, help='size in bytes of the contents of each write')
+    parser.add_argument('--distribution', choices=['uniform', 'zipf'], default='uniform', help='distribution of accessed files')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='exponent of the Zipfian distribution')
+    parser.add_argument('--workloads', nargs='+', choices=list(WORKLOADS), default=list(WORKLOADS), help='workloads to run')
+    parser.add_argument('--output', default='benchmark.csv', help='output CSV file')
+    args = parser.parse_args()
+
+    # A small pool of random contents keeps content generation out of the measured latency
+    contents = [''.join(random.choices(string.ascii_uppercase + string.digits, k=args.file_size)) for _ in range(16)]
+    quorums = get_quorums(args.servers)
+
+    rows = ['workload,q_read,q_write,distribution,file_size,threads,op,count,throughput,p50,p99']
+    for q_read, q_write in quorums:
+        with tempfile.TemporaryDirectory() as storage_path:
+            config = make_config(storage_path, args.servers, args.coordinators, q_read, q_write)
+            config_file = os.path.join(storage_path, 'config.json')
+            processes = start_cluster(config, config_file)
+            try:
+                servers = [(s['host'], s['port']) for s in config['servers']]
+                # Write every file once so that reads never miss
+                client, transport = connect_server(*servers[0])
+                transport.open()
+                for i in range(args.files):
+                    client.write(f'{i}.txt', contents[0])
+                transport.close()
+                for workload in args.workloads:
+                    for op, count, throughput, p50, p99 in run_workload(servers, args, WORKLOADS[workload], contents):
+                        print(f'[Benchmark] {workload} (q_read={q_read}, q_write={q_write}) {op}: {throughput:.1f} ops/sec, p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms.')
+                        rows.append(f'{workload},{q_read},{q_write},{args.distribution},{args.file_size},{args.threads},{op},{count},{throughput},{p50},{p99}')
+            finally:
+                stop_cluster(processes)
+    with open(args.output, 'w') as file:
+        file.write('\n'.join(rows) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Tuple
+
+
+class ClientCache:
+    """
+    Caches the contents of the latest version of each file read by a client, evicting the least
+    recently used files once the cached contents exceed capacity bytes. A cached entry is never
+    trusted on its own, every read validates its version with the cluster first.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, file_name: str) -> Optional[Tuple[int, str]]:
+        with self.lock:
+            entry = self.entries.get(file_name)
+            if entry is not None:
+                self.entries.move_to_end(file_name)
+            return entry
+
+    def put(self, file_name: str, version: int, content: str) -> None:
+        size = len(content.encode('utf-8'))
+        with self.lock:
+            self.remove_locked(file_name)
+            if size > self.capacity:
+                return
+            self.entries[file_name] = (version, content)
+            self.size += size
+            while self.size > self.capacity:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted.encode('utf-8'))
+
+    def invalidate(self, file_name: str) -> None:
+        with self.lock:
+            self.remove_locked(file_name)
+
+    def remove_locked(self, file_name: str) -> None:
+        entry = self.entries.pop(file_name, None)
+        if entry is not None:
+            self.size -= len(entry[1].encode('utf-8'))
@@ -1,15 +1,17 @@
 import sys
 import random
 import time
-from typing import Tuple
+import uuid
+from typing import List, Optional, Tuple
 
 from thrift.transport import TSocket
 from thrift.protocol import TBinaryProtocol
 
 from gen.service import ServerService
-from gen.service.ttypes import FileNotFound
+from gen.service.ttypes import FileNotFound, StaleVersion, WriteOp
 
 from utils import load_config
+from cache import ClientCache
 
 def log_client(message: str) -> None:
     print(f'[Client {client_num}] {message}')
@@ -20,6 +22,68 @@ def connect_server(host: str, port: int) -> Tuple[ServerService.Client, TSocket.
     client = ServerService.Client(protocol)
     return client, transport
 
+def upload_file(client: ServerService.Client, file_name: str, local_path: str, chunk_size: int) -> int:
+    # Stream the local file to the server one chunk at a time, then have the server write it to the cluster
+    upload_id = uuid.uuid4().hex
+    size = 0
+    with open(local_path, 'rb') as file:
+        while True:
+            data = file.read(chunk_size)
+            if len(data) == 0:
+                break
+            client.upload_chunk(upload_id, size, data)
+            size += len(data)
+    client.commit_upload(file_name, upload_id, size)
+    return size
+
+def download_file(client: ServerService.Client, file_name: str, local_path: str, chunk_size: int) -> int:
+    # Every chunk is pinned to the version of the first chunk, start over if that version is overwritten mid-download
+    while True:
+        version = 0
+        size = 0
+        try:
+            with open(local_path, 'wb') as file:
+                while True:
+                    chunk = client.read_chunk(file_name, version, size, chunk_size)
+                    version = chunk.version
+                    file.write(chunk.data)
+                    size += len(chunk.data)
+                    if len(chunk.data) < chunk_size:
+                        return size
+        except StaleVersion as _:
+            continue
+
+def read_file(client: ServerService.Client, file_name: str, cache: Optional[ClientCache]) -> str:
+    # Only transfer the contents if the cached version is no longer the latest one
+    cached = cache.get(file_name) if cache is not None else None
+    result = client.read_if_modified(file_name, cached[0] if cached is not None else 0)
+    if not result.modified:
+        return cached[1]
+    if cache is not None:
+        cache.put(file_name, result.version, result.content)
+    return result.content
+
+def run_batch(servers: List, command: str, batch: List[List[str]], cache: Optional[ClientCache]) -> None:
+    # Send a run of consecutive write or read commands to a single server in one request
+    server = random.choice(servers)
+    client, transport = connect_server(server[0], server[1])
+    transport.open()
+    try:
+        if command == 'write':
+            client.write_batch([WriteOp(parts[1], parts[2]) for parts in batch])
+            for parts in batch:
+                if cache is not None:
+                    cache.invalidate(parts[1])
+                log_client(f'Wrote "{parts[2]}" to file "{parts[1]}".')
+        else:
+            for result in client.read_batch([parts[1] for parts in batch]):
+                if result.found:
+                    log_client(f'File "{result.file_name}" has content: "{result.content}".')
+                else:
+                    log_client(f'Could not find file: "{result.file_name}".')
+    finally:
+        transport.close()
+
 def main():
     global client_num
     if len(sys.argv) < 2:
@@ -33,21 +97,34 @@ def main():
     config = load_config(config_file)
     servers = [(s['host'], s['port']) for s in config['servers']]
     commands_file = config['clients'][client_num]['commands_file']
+    chunk_size = config.get('chunk_size', 1048576)
+    batch_size = config.get('batch_size', 1)
+    cache_bytes = config.get('client_cache_bytes', 0)
+    cache = ClientCache(cache_bytes) if cache_bytes > 0 else None
 
     with open(commands_file) as file:
         lines = [line.rstrip() for line in file]
         start = time.time()
+        batch = []
         for line in lines:
             if len(line) == 0:
                 continue
             parts = line.strip().split(' ', 2)
-            if len(parts) == 0:
+            is_batchable = (parts[0] == 'write' and len(parts) >= 3) or (parts[0] == 'read' and len(parts) >= 2)
+            if len(batch) > 0 and (not is_batchable or parts[0] != batch[0][0] or len(batch) >= batch_size):
+                run_batch(servers, batch[0][0], batch, cache)
+                batch = []
+            if batch_size > 1 and is_batchable:
+                batch.append(parts)
+            elif len(parts) == 0:
                 log_client(f'Unknown command: {line}')
             elif parts[0] == 'write' and len(parts) >= 3:
                 server = random.choice(servers)
                 client, transport = connect_server(server[0], server[1])
                 transport.open()
                 try:
+                    if cache is not None:
+                        cache.invalidate(parts[1])
                     client.write(parts[1], parts[2])
                     log_client(f'Wrote "{parts[2]}" to file "{parts[1]}".')
                 finally:
@@ -57,12 +134,34 @@ def main():
                 client, transport = connect_server(server[0], server[1])
                 transport.open()
                 try:
-                    content = client.read(parts[1])
+                    content = read_file(client, parts[1], cache)
                     log_client(f'File "{parts[1]}" has content: "{content}".')
                 except FileNotFound as _:
                     log_client(f'Could not find file: "{parts[1]}".')
                 finally:
                     transport.close()
+            elif parts[0] == 'upload' and len(parts) >= 3:
+                server = random.choice(servers)
+                client, transport = connect_server(server[0], server[1])
+                transport.open()
+                try:
+                    if cache is not None:
+                        cache.invalidate(parts[1])
+                    size = upload_file(client, parts[1], parts[2], chunk_size)
+                    log_client(f'Uploaded {size} bytes from "{parts[2]}" to file "{parts[1]}".')
+                finally:
+                    transport.close()
+            elif parts[0] == 'download' and len(parts) >= 3:
+                server = random.choice(servers)
+                client, transport = connect_server(server[0], server[1])
+                transport.open()
+                try:
+                    size = download_file(client, parts[1], parts[2], chunk_size)
+                    log_client(f'Downloaded {size} bytes from file "{parts[1]}" to "{parts[2]}".')
+                except FileNotFound as _:
+                    log_client(f'Could not find file: "{parts[1]}".')
+                finally:
+                    transport.close()
             elif parts[0] == 'sleep' and len(parts) >= 2:
                 log_client(f'Sleeping for {parts[1]} seconds.')
                 time.sleep(float(parts[1]))
@@ -77,6 +176,8 @@ def main():
                     transport.close()
             else:
                 log_client(f'Unknown command: {line}')
+        if len(batch) > 0:
+            run_batch(servers, batch[0][0], batch, cache)
         end = time.time()
         log_client(f'Finished executing all commands in {end - start} seconds.')
 
@@ -10,6 +10,8 @@ from gen.service import ServerService
 from gen.service.ttypes import FileNotFound
 
 from utils import load_config
+from client import upload_file, download_file, read_file
+from cache import ClientCache
 
 def log_client(message: str) -> None:
     print(f'[Client] {message}')
@@ -28,8 +30,13 @@ def main():
     print('  write <file_name> <content> - overwrites the content in the file with name <file_name> with the content specificed in <content>')
     print('  read <file_name> - reads the content from the file with name <file_name>')
     print('  list - lists all of the files stored on the system and their corresponding version numers')
+    print('  upload <file_name> <local_path> - streams the local file <local_path> into the file with name <file_name>')
+    print('  download <file_name> <local_path> - streams the content of the file with name <file_name> into the local file <local_path>')
     config = load_config(config_file)
     servers = [(s['host'], s['port']) for s in config['servers']]
+    chunk_size = config.get('chunk_size', 1048576)
+    cache_bytes = config.get('client_cache_bytes', 0)
+    cache = ClientCache(cache_bytes) if cache_bytes > 0 else None
     for line in sys.stdin:
         parts = line.strip().split(' ', 2)
         if len(parts) == 0:
@@ -39,6 +46,8 @@ def main():
             client, transport = connect_server(server[0], server[1])
             transport.open()
             try:
+                if cache is not None:
+                    cache.invalidate(parts[1])
                 client.write(parts[1], parts[2])
                 log_client(f'Wrote "{parts[2]}" to file "{parts[1]}".')
             finally:
@@ -48,12 +57,34 @@ def main():
             client, transport = connect_server(server[0], server[1])
             transport.open()
             try:
-                content = client.read(parts[1])
+                content = read_file(client, parts[1], cache)
                 log_client(f'File "{parts[1]}" has content: "{content}".')
             except FileNotFound as _:
                 log_client(f'Could not find file: "{parts[1]}".')
             finally:
                 transport.close()
+        elif parts[0] == 'upload' and len(parts) >= 3:
+            server = random.choice(servers)
+            client, transport = connect_server(server[0], server[1])
+            transport.open()
+            try:
+                if cache is not None:
+                    cache.invalidate(parts[1])
+                size = upload_file(client, parts[1], parts[2], chunk_size)
+                log_client(f'Uploaded {size} bytes from "{parts[2]}" to file "{parts[1]}".')
+            finally:
+                transport.close()
+        elif parts[0] == 'download' and len(parts) >= 3:
+            server = random.choice(servers)
+            client, transport = connect_server(server[0], server[1])
+            transport.open()
+            try:
+                size = download_file(client, parts[1], parts[2], chunk_size)
+                log_client(f'Downloaded {size} bytes from file "{parts[1]}" to "{parts[2]}".')
+            except FileNotFound as _:
+                log_client(f'Could not find file: "{parts[1]}".')
+            finally:
+                transport.close()
         elif parts[0] == 'list':
             server = random.choice(servers)
             client, transport = connect_server(server[0], server[1])
@@ -0,0 +1,64 @@
+import sys
+import json
+import time
+import socket
+from subprocess import Popen, DEVNULL
+from typing import List
+
+# Helpers for starting a cluster of servers on the local machine, e.g. for benchmarks
+
+def make_config(storage_path: str, num_servers: int, num_coordinators: int, q_read: int, q_write: int, base_port: int = 8100, delays: List[float] = None, **options) -> dict:
+    servers = []
+    for i in range(num_servers):
+        # Coordinators send their requests to the replica port, which the "pool" server mode requires to be separate
+        server = {'host': '127.0.0.1', 'port': base_port + i, 'replica_port': base_port + num_servers + num_coordinators + i}
+        # Optional artificial latency in seconds added to every replica RPC handled by the server
+        if delays is not None and delays[i] > 0:
+            server['delay'] = delays[i]
+        # The first "num_coordinators" servers also run a coordinator for one shard each
+        if i < num_coordinators:
+            server['coordinator'] = True
+            server['coordinator_port'] = base_port + num_servers + i
+        servers.append(server)
+    config = {
+        'debug': False,
+        'q_write': q_write,
+        'q_read': q_read,
+        'storage_path': storage_path,
+        'coordinator_sleep_delay': 0,
+        'servers': servers,
+        'clients': []
+    }
+    config.update(options)
+    return config
+
+def write_config(config: dict, config_file: str) -> None:
+    with open(config_file, 'w') as file:
+        json.dump(config, file, indent=4)
+
+def wait_for_port(host: str, port: int, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+def start_cluster(config: dict, config_file: str) -> List[Popen]:
+    write_config(config, config_file)
+    processes = [Popen([sys.executable, 'server.py', str(i), config_file], stdout=DEVNULL) for i in range(len(config['servers']))]
+    for server in config['servers']:
+        wait_for_port(server['host'], server['port'])
+        wait_for_port(server['host'], server.get('replica_port', server['port']))
+        if server.get('coordinator', False):
+            wait_for_port(server['host'], server['coordinator_port'])
+    return processes
+
+def stop_cluster(processes: List[Popen]) -> None:
+    for p in processes:
+        p.kill()
+    for p in processes:
+        p.wait()
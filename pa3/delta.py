@@ -0,0 +1,82 @@
+import hashlib
+from itertools import accumulate
+from typing import Dict, List, Optional, Tuple
+
+MOD = 1 << 16
+
+
+def weak_checksum(block: bytes) -> Tuple[int, int]:
+    # rsync style rolling checksum, "b" is the sum of the prefix sums of the block
+    return sum(block) % MOD, sum(accumulate(block)) % MOD
+
+
+def strong_checksum(block: bytes) -> bytes:
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def block_signatures(data: bytes, block_size: int) -> List[Tuple[int, bytes]]:
+    # Signatures are only computed for full blocks, a trailing partial block is always sent as a literal
+    signatures = []
+    for offset in range(0, len(data) - block_size + 1, block_size):
+        block = data[offset:offset + block_size]
+        a, b = weak_checksum(block)
+        signatures.append((a | (b << 16), strong_checksum(block)))
+    return signatures
+
+
+def compute_delta(signatures: List[Tuple[int, bytes]], data: bytes, block_size: int, max_literal_size: int = -1) -> Optional[List[Tuple[int, int, bytes]]]:
+    """
+    Encodes data as a list of (block, count, literal) operations against a base file with the given
+    block signatures. An operation with a positive count copies "count" blocks of the base file
+    starting at "block", otherwise it appends the literal bytes. Returns None as soon as more than
+    max_literal_size bytes would have to be sent as literals.
+    """
+    blocks: Dict[int, Dict[bytes, int]] = {}
+    for index, (weak, strong) in enumerate(signatures):
+        blocks.setdefault(weak, {}).setdefault(strong, index)
+
+    delta = []
+
+    def add_copy(index: int):
+        if len(delta) > 0 and delta[-1][1] > 0 and delta[-1][0] + delta[-1][1] == index:
+            delta[-1] = (delta[-1][0], delta[-1][1] + 1, b'')
+        else:
+            delta.append((index, 1, b''))
+
+    literal_size = 0
+    literal_start = 0
+    offset = 0
+    if len(data) >= block_size:
+        a, b = weak_checksum(data[:block_size])
+    while offset + block_size <= len(data):
+        candidates = blocks.get(a | (b << 16))
+        if candidates is not None:
+            index = candidates.get(strong_checksum(data[offset:offset + block_size]))
+            if index is not None:
+                if literal_start < offset:
+                    delta.append((0, 0, data[literal_start:offset]))
+                    literal_size += offset - literal_start
+                add_copy(index)
+                offset += block_size
+                literal_start = offset
+                if offset + block_size <= len(data):
+                    a, b = weak_checksum(data[offset:offset + block_size])
+                continue
+        if max_literal_size >= 0 and literal_size + offset - literal_start > max_literal_size:
+            return None
+        # Roll the checksum forward by a single byte
+        if offset + block_size < len(data):
+            removed = data[offset]
+            a = (a - removed + data[offset + block_size]) % MOD
+            b = (b - block_size * removed + a) % MOD
+        offset += 1
+    if literal_start < len(data):
+        if max_literal_size >= 0 and literal_size + len(data) - literal_start > max_literal_size:
+            return None
+        delta.append((0, 0, data[literal_start:]))
+    return delta
+
+
+def delta_size(delta: List[Tuple[int, int, bytes]]) -> int:
+    # Approximate number of bytes needed to send the delta
+    return sum(len(literal) + 12 for _, _, literal in delta)
@@ -0,0 +1,172 @@
+import time
+import bisect
+from threading import Lock, Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+# Upper bounds in seconds of the buckets of latency histograms
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if len(labels) == 0:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metric:
+    def __init__(self, name: str, description: str, metric_type: str):
+        self.name = name
+        self.description = description
+        self.metric_type = metric_type
+        self.lock = Lock()
+        self.values: Dict[Tuple[Tuple[str, str], ...], object] = {}
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.metric_type}']
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.extend(self.render_value(labels, value))
+        return lines
+
+    def render_value(self, labels: Tuple[Tuple[str, str], ...], value) -> List[str]:
+        return [f'{self.name}{format_labels(labels)} {value}']
+
+
+class Counter(Metric):
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description, 'counter')
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description, 'gauge')
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    """
+    Counts observations in cumulative buckets together with their sum, like a Prometheus histogram.
+    """
+    def __init__(self, name: str, description: str, buckets: List[float] = LATENCY_BUCKETS):
+        super().__init__(name, description, 'histogram')
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One count per bucket, the count of observations above every bucket, and the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def render_value(self, labels: Tuple[Tuple[str, str], ...], value) -> List[str]:
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ['+Inf'], value):
+            total += count
+            lines.append(f'{self.name}_bucket{format_labels(labels + (("le", bound),))} {total}')
+        lines.append(f'{self.name}_sum{format_labels(labels)} {value[-1]}')
+        lines.append(f'{self.name}_count{format_labels(labels)} {total}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = Lock()
+
+    def register(self, metric: Metric):
+        # Registering the same name twice returns the existing metric so modules can declare metrics independently
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self.register(Counter(name, description))
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self.register(Gauge(name, description))
+
+    def histogram(self, name: str, description: str, buckets: List[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, buckets))
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+RPC_LATENCY = REGISTRY.histogram('rpc_duration_seconds', 'Time spent handling each RPC.')
+RPC_ERRORS = REGISTRY.counter('rpc_errors_total', 'Number of RPCs which raised an exception.')
+RPC_IN_FLIGHT = REGISTRY.gauge('rpc_in_flight', 'Number of RPCs currently being handled.')
+
+
+class InstrumentedHandler:
+    """
+    Wraps a Thrift handler so that every RPC records its latency, errors and the number of RPCs in flight.
+    """
+    def __init__(self, handler, service: str):
+        self.handler = handler
+        self.service = service
+
+    def __getattr__(self, name: str):
+        method = getattr(self.handler, name)
+        if not callable(method):
+            return method
+
+        def instrumented(*args, **kwargs):
+            RPC_IN_FLIGHT.inc(service=self.service, method=name)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception as _:
+                RPC_ERRORS.inc(service=self.service, method=name)
+                raise
+            finally:
+                RPC_LATENCY.observe(time.perf_counter() - start, service=self.service, method=name)
+                RPC_IN_FLIGHT.dec(service=self.service, method=name)
+        return instrumented
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def start_metrics_server(port: int) -> None:
+    # Serves the metrics of this process at http://<host>:<port>/metrics
+    server = ThreadingHTTPServer(('', port), MetricsRequestHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
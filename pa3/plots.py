@@ -1,27 +1,36 @@
+import sys
+import csv
 from matplotlib import pyplot as plt
-from numpy import genfromtxt
 import numpy as np
 
-if __name__ == '__main__':
-    bar_width = 0.25
+WORKLOADS = ['read_heavy', 'mixed', 'write_heavy']
 
-    read_heavy = [83.345, 87.668, 94.161, 97.725]
-    mixed = [66.318, 57.918, 54.741, 48.475]
-    write_heavy = [50.656, 42.516, 36.650, 32.423]
+def load_results(results_file: str) -> dict:
+    # Maps (workload, q_read, q_write, op) to the row produced by benchmark.py
+    with open(results_file, newline='') as file:
+        return {(row['workload'], int(row['q_read']), int(row['q_write']), row['op']): row for row in csv.DictReader(file)}
+
+def bar_chart(results: dict, quorums: list, column: str, scale: float, ylabel: str, output_file: str) -> None:
+    bar_width = 0.25
+    workloads = [w for w in WORKLOADS if any(key[0] == w for key in results)]
 
-    
-    r1 = np.arange(len(read_heavy))
-    r2 = [x + bar_width for x in r1]
-    r3 = [x + bar_width for x in r2]
-    
     plt.clf()
-    plt.bar(r1, read_heavy, width=bar_width, edgecolor='white', label='read heavy')
-    plt.bar(r2, mixed, width=bar_width, edgecolor='white', label='mixed')
-    plt.bar(r3, write_heavy, width=bar_width, edgecolor='white', label='write heavy')
-    
-    plt.ylabel('Throughput (ops/sec)')
+    for i, workload in enumerate(workloads):
+        values = [float(results[(workload, q_read, q_write, 'all')][column]) * scale for q_read, q_write in quorums]
+        positions = np.arange(len(quorums)) + i * bar_width
+        plt.bar(positions, values, width=bar_width, edgecolor='white', label=workload.replace('_', ' '))
+
+    plt.ylabel(ylabel)
     plt.xlabel('Quorum sizes (read/write)')
-    plt.xticks([r + bar_width for r in range(len(read_heavy))], ['4/4', '3/5', '2/6', '1/7'])
-    
+    plt.xticks([r + bar_width for r in range(len(quorums))], [f'{q_read}/{q_write}' for q_read, q_write in quorums])
+
     plt.legend()
-    plt.savefig('bar_chart.png')
\ No newline at end of file
+    plt.savefig(output_file)
+
+if __name__ == '__main__':
+    results_file = sys.argv[1] if len(sys.argv) > 1 else 'benchmark.csv'
+    results = load_results(results_file)
+    quorums = sorted({(key[1], key[2]) for key in results}, key=lambda q: (-q[0], q[1]))
+
+    bar_chart(results, quorums, 'throughput', 1, 'Throughput (ops/sec)', 'bar_chart.png')
+    bar_chart(results, quorums, 'p99', 1000, 'p99 latency (ms)', 'latency_chart.png')
@@ -0,0 +1,59 @@
+import time
+import random
+from contextlib import contextmanager
+from threading import Lock
+from typing import List, Tuple
+
+QUORUM_SELECTION_POLICIES = ['random', 'latency']
+
+
+class ReplicaSelector:
+    """
+    Chooses which servers form a quorum.
+
+    The "random" policy samples servers uniformly. The "latency" policy keeps an exponentially
+    weighted moving average (EWMA) of each server's RPC latency together with its number of
+    in-flight RPCs and picks the servers with the lowest expected latency, replacing the slowest
+    member of the quorum with a random slower server with probability probe_rate so that servers
+    which recover are eventually noticed.
+    """
+    def __init__(self, servers: List[Tuple[str, int]], policy: str = 'random', alpha: float = 0.2, probe_rate: float = 0.05):
+        if policy not in QUORUM_SELECTION_POLICIES:
+            raise ValueError(f'Unknown quorum selection policy "{policy}".')
+        self.servers = servers
+        self.policy = policy
+        self.alpha = alpha
+        self.probe_rate = probe_rate
+        self.lock = Lock()
+        self.latencies = {server: 0.0 for server in servers}
+        self.in_flight = {server: 0 for server in servers}
+
+    def get_score(self, server: Tuple[str, int]) -> float:
+        # Servers without any samples have a score of 0 and are tried first
+        return self.latencies[server] * (self.in_flight[server] + 1)
+
+    def choose(self, q: int) -> List[Tuple[str, int]]:
+        if self.policy == 'random':
+            return random.sample(self.servers, q)
+        with self.lock:
+            ranked = sorted(self.servers, key=self.get_score)
+        quorum = ranked[:q]
+        if q < len(ranked) and random.random() < self.probe_rate:
+            quorum[-1] = random.choice(ranked[q:])
+        return quorum
+
+    @contextmanager
+    def track(self, server: Tuple[str, int]):
+        with self.lock:
+            self.in_flight[server] += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            latency = time.monotonic() - start
+            with self.lock:
+                self.in_flight[server] -= 1
+                if self.latencies[server] == 0:
+                    self.latencies[server] = latency
+                else:
+                    self.latencies[server] += self.alpha * (latency - self.latencies[server])
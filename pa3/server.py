@@ -2,21 +2,35 @@
 import sys
 import os
 import time
-from typing import List, Tuple
-from random import sample
-from threading import Lock, Thread
+import shutil
+from typing import Callable, Dict, List, Optional, Tuple
+from contextlib import contextmanager, nullcontext, ExitStack
+from threading import Condition, Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from gen.service import CoordinatorService, ServerService
-from gen.service.ttypes import FileNotFound, FileObject
+from gen.service.ttypes import FileNotFound, FileObject, FileChunk, StaleVersion, BlockSignature, DeltaOp, WriteOp, FileUpdate, ReadResult, LeasedRead, ConditionalRead
 
 from thrift.transport import TSocket
 from thrift.transport import TTransport
 from thrift.protocol import TBinaryProtocol
 from thrift.server import TServer
 
-from utils import load_config
+from utils import load_config, get_shard, write_at, read_at, truncate
 from locks import ReadWriteLock, StandardLock
+from storage import StaleVersionError, open_store
+from delta import compute_delta, delta_size
+from selector import ReplicaSelector
+from metrics import REGISTRY, InstrumentedHandler, start_metrics_server
+from anti_entropy import NUM_BUCKETS, TokenBucket, bucket_digests, find_stale, get_bucket
+
+LOCK_WAIT = REGISTRY.histogram('coordinator_lock_wait_seconds', 'Time spent waiting for file locks.')
+LOCK_WAIT_BY_FILE = REGISTRY.counter('coordinator_lock_wait_seconds_total', 'Total time spent waiting for the lock of each file.')
+FANOUT_LATENCY = REGISTRY.histogram('coordinator_fanout_seconds', 'Time taken to send a request to every server of a quorum.')
+BYTES_READ = REGISTRY.counter('server_bytes_read_total', 'Bytes of file contents read from storage for coordinators.')
+BYTES_WRITTEN = REGISTRY.counter('server_bytes_written_total', 'Bytes of file contents received from coordinators and written to storage.')
+
 
 def log_server(message: str) -> None:
     if DEBUG:
@@ -42,14 +56,80 @@ def connect_coordinator(host: str, port: int) -> Tuple[CoordinatorService.Client
     return client, transport
 
 
+class PendingWrite:
+    def __init__(self, content: str):
+        self.content = content
+        self.done = False
+        self.error = None
+
+
 class CoordinatorHandler:
-    def __init__(self, q_write: int, q_read: int, servers: List, locking_scheme: str):
+    def __init__(self, shard: int, num_shards: int, q_write: int, q_read: int, servers: List, selector: ReplicaSelector, locking_scheme: str, list_page_size: int, chunk_size: int, delta_block_size: int, lease_duration: float, anti_entropy_interval: float, anti_entropy_rate: int, fanout_threads: int, write_coalescing: bool):
+        # This coordinator only handles files whose name hashes to its shard
+        self.shard = shard
+        self.num_shards = num_shards
         self.q_write = q_write
         self.q_read = q_read
         self.locking_scheme = locking_scheme
         self.servers = servers
+        self.selector = selector
+        self.list_page_size = list_page_size
+        self.chunk_size = chunk_size
+        self.delta_block_size = delta_block_size
+        self.lease_duration = lease_duration
         self.file_table = {}
         self.file_table_lock = Lock()
+        # Latest committed version of each file, guarded by the file table lock
+        self.version_table = {}
+        self.version_table_loaded = False
+        self.version_table_load_lock = Lock()
+        # Version and server from the most recent read quorum for each file
+        self.read_locations = {}
+        # Expiry time of every read lease granted to a server, for each file
+        self.leases = {}
+        self.lease_lock = Lock()
+        # Writes queued behind a write in progress to the same file, applied together in the next round
+        self.write_coalescing = write_coalescing
+        self.pending_writes = {}
+        self.writing_files = set()
+        self.pending_writes_cv = Condition(Lock())
+        # Requests to the servers of a quorum are sent concurrently by a shared pool of threads
+        self.executor = ThreadPoolExecutor(fanout_threads) if fanout_threads > 0 else None
+        # Replicas are compared every anti_entropy_interval seconds, missing versions are sent at anti_entropy_rate bytes per second
+        self.anti_entropy_interval = anti_entropy_interval
+        self.anti_entropy_limiter = TokenBucket(anti_entropy_rate, max(anti_entropy_rate, chunk_size))
+        if anti_entropy_interval > 0:
+            Thread(target=self.run_anti_entropy, daemon=True).start()
+
+    @contextmanager
+    def connect(self, server: Tuple[str, int], track: bool = True):
+        # Open a connection to a server, recording the latency of the RPCs made over it. Connections which stream
+        # many chunks pass track=False, since the time of the whole transfer says nothing about a single RPC.
+        host, port = server
+        client, transport = connect_server(host, port)
+        with self.selector.track(server) if track else nullcontext():
+            transport.open()
+            try:
+                yield client
+            finally:
+                transport.close()
+
+    def parallel(self, items: List, fn: Callable) -> List:
+        # Applies fn to every item concurrently and returns the results in order, raising the first error
+        start = time.perf_counter()
+        try:
+            if self.executor is None or len(items) <= 1:
+                return [fn(item) for item in items]
+            return list(self.executor.map(fn, items))
+        finally:
+            FANOUT_LATENCY.observe(time.perf_counter() - start)
+
+    def fan_out(self, servers: List[Tuple[str, int]], fn: Callable) -> Dict[Tuple[str, int], object]:
+        # Calls fn with a client connected to each server
+        def call(server: Tuple[str, int]):
+            with self.connect(server) as client:
+                return fn(client)
+        return dict(zip(servers, self.parallel(servers, call)))
 
     def get_file_lock(self, file_name: str):
         with self.file_table_lock:
@@ -59,109 +139,434 @@ class CoordinatorHandler:
                 file_lock = self.file_table[file_name] = ReadWriteLock() if self.locking_scheme == 'readwrite' else StandardLock()
             return file_lock
 
+    def acquire_lock(self, file_name: str, file_lock, mode: str) -> None:
+        start = time.perf_counter()
+        if mode == 'write':
+            file_lock.acquire_write()
+        else:
+            file_lock.acquire_read()
+        wait = time.perf_counter() - start
+        LOCK_WAIT.observe(wait, mode=mode)
+        LOCK_WAIT_BY_FILE.inc(wait, file=file_name)
+
+    def commit_version(self, file_name: str, version: int) -> None:
+        with self.file_table_lock:
+            if version > self.version_table.get(file_name, 0):
+                self.version_table[file_name] = version
+
+    def load_version_table(self) -> None:
+        # Seed the version table from a read quorum, paging through each server's files
+        with self.version_table_load_lock:
+            if self.version_table_loaded:
+                return
+            read_quorum = self.selector.choose(self.q_read)
+            log_coordinator(f'Loading file versions from read quorum consisting of servers: {read_quorum}.')
+            def load_files(client: ServerService.Client) -> None:
+                start_after = ''
+                while True:
+                    files = client.get_files('', start_after, self.list_page_size)
+                    for f in files:
+                        if get_shard(f.file_name, self.num_shards) == self.shard:
+                            self.commit_version(f.file_name, f.version)
+                    if len(files) < self.list_page_size:
+                        break
+                    start_after = files[-1].file_name
+            self.fan_out(read_quorum, load_files)
+            self.version_table_loaded = True
+
+    def revoke_leases(self, file_names: List[str]) -> None:
+        # Must be called while holding the write lock of every file so that no new leases are granted
+        holders = []
+        with self.lease_lock:
+            for file_name in file_names:
+                holders.extend((file_name, server, expiry) for server, expiry in self.leases.pop(file_name, {}).items())
+        def revoke(holder: Tuple[str, Tuple[str, int], float]) -> None:
+            file_name, (host, port), expiry = holder
+            if time.monotonic() >= expiry:
+                return
+            try:
+                with self.connect((host, port)) as client:
+                    client.revoke_lease(file_name)
+                log_coordinator(f'Revoked read lease for "{file_name}" held by server {host}:{port}.')
+            except TTransport.TTransportException as _:
+                # The lease holder is unreachable, it is safe to write once its lease has expired
+                log_coordinator(f'Unable to revoke read lease for "{file_name}" held by server {host}:{port}, waiting for it to expire.')
+                time.sleep(max(0, expiry - time.monotonic()))
+        self.parallel(holders, revoke)
+
+    def get_server_versions(self, quorum: List, file_name: str) -> Dict[Tuple, int]:
+        server_versions = self.fan_out(quorum, lambda client: client.get_version(file_name))
+        for server, server_version in server_versions.items():
+            log_coordinator(f'Server {server[0]}:{server[1]} has version {server_version} for file "{file_name}".')
+        return server_versions
+
+    def get_max_version(self, quorum: List, file_name: str) -> Tuple[int, Tuple]:
+        # Returns the highest version of the file in the quorum and a server holding it
+        version = 0
+        latest_server = None
+        for server, server_version in self.get_server_versions(quorum, file_name).items():
+            if server_version > version:
+                latest_server = server
+                version = server_version
+        return version, latest_server
+
+    def find_latest(self, file_name: str) -> Tuple[int, Tuple]:
+        read_quorum = self.selector.choose(self.q_read)
+        log_coordinator(f'Formed read quorum consisting of servers: {read_quorum}.')
+        version, read_server = self.get_max_version(read_quorum, file_name)
+        if read_server is None:
+            log_coordinator('No server was found to have a file version number greater than 0.')
+            raise FileNotFound()
+        log_coordinator(f'Server {read_server[0]}:{read_server[1]} has the highest version ({version}) for file "{file_name}".')
+        self.read_locations[file_name] = (version, read_server)
+        return version, read_server
+
     def write(self, file_name: str, content: str) -> None:
-        log_coordinator(f'Received request to write "{content}" to "{file_name}".')
+        if DEBUG:
+            log_coordinator(f'Received request to write {len(content)} characters to "{file_name}".')
+        if not self.write_coalescing:
+            file_lock = self.get_file_lock(file_name)
+            self.acquire_lock(file_name, file_lock, 'write')
+            log_coordinator(f'Successfully acquired file lock.')
+            try:
+                self.write_locked(file_name, content)
+            finally:
+                file_lock.release_write()
+            return
+        pending_write = PendingWrite(content)
+        with self.pending_writes_cv:
+            self.pending_writes.setdefault(file_name, []).append(pending_write)
+            # Wait while another writer applies a round to the file, it may include this write as well
+            while not pending_write.done and file_name in self.writing_files:
+                self.pending_writes_cv.wait()
+            if pending_write.done:
+                if pending_write.error is not None:
+                    raise pending_write.error
+                return
+            # Every write queued so far is applied in one round, only the last one is visible afterwards
+            self.writing_files.add(file_name)
+            pending_writes = self.pending_writes.pop(file_name)
+        log_coordinator(f'Coalescing {len(pending_writes)} queued writes to "{file_name}".')
+        error = None
         file_lock = self.get_file_lock(file_name)
-        file_lock.acquire_write()
+        self.acquire_lock(file_name, file_lock, 'write')
         log_coordinator(f'Successfully acquired file lock.')
         try:
-            version = 0
-            write_quorum = sample(self.servers, self.q_write)
+            self.write_locked(file_name, pending_writes[-1].content)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            file_lock.release_write()
+            with self.pending_writes_cv:
+                for queued_write in pending_writes:
+                    queued_write.error = error
+                    queued_write.done = True
+                self.writing_files.discard(file_name)
+                self.pending_writes_cv.notify_all()
+
+    def write_locked(self, file_name: str, content: str) -> None:
+        # Must be called while holding the write lock of the file
+        self.revoke_leases([file_name])
+        write_quorum = self.selector.choose(self.q_write)
+        log_coordinator(f'Formed write quorum consisting of servers: {write_quorum}.')
+        server_versions = self.get_server_versions(write_quorum, file_name)
+        base_version = max(server_versions.values())
+        log_coordinator(f'The version for file "{file_name}" is {base_version}.')
+        version = base_version + 1
+        # Servers which hold the latest version only need the changes made to it
+        base_servers = [server for server in write_quorum if server_versions[server] == base_version]
+        delta = self.get_delta(base_servers, file_name, base_version, content) if base_version > 0 else None
+        log_coordinator(f'Updating file contents across all servers in write quorum.')
+        def update(server: Tuple[str, int]) -> None:
+            with self.connect(server) as client:
+                if delta is not None and server in base_servers:
+                    try:
+                        client.update_delta(file_name, base_version, version, self.delta_block_size, delta)
+                        return
+                    except StaleVersion as _:
+                        log_coordinator(f'Server {server[0]}:{server[1]} no longer has version {base_version} of "{file_name}", sending full contents.')
+                client.update(file_name, version, content)
+        self.parallel(write_quorum, update)
+        self.commit_version(file_name, version)
+        log_coordinator(f'Finished writing to "{file_name}".')
+
+    def write_batch(self, writes: List[WriteOp]) -> None:
+        log_coordinator(f'Received request to write a batch of {len(writes)} writes.')
+        # Writes later in the batch overwrite earlier writes to the same file
+        contents = {}
+        for write in writes:
+            contents[write.file_name] = write.content
+        # Acquire the file locks in sorted order so that concurrent batches can never deadlock
+        file_names = sorted(contents)
+        file_locks = [self.get_file_lock(file_name) for file_name in file_names]
+        acquired_locks = []
+        try:
+            for file_name, file_lock in zip(file_names, file_locks):
+                self.acquire_lock(file_name, file_lock, 'write')
+                acquired_locks.append(file_lock)
+            self.revoke_leases(file_names)
+            write_quorum = self.selector.choose(self.q_write)
             log_coordinator(f'Formed write quorum consisting of servers: {write_quorum}.')
-            for server in write_quorum:
-                host, port = server
-                client, transport = connect_server(host, port)
-                transport.open()
-                server_version = client.get_version(file_name)
-                log_coordinator(f'Server {host}:{port} has version {server_version} for file "{file_name}".')
-                version = max(client.get_version(file_name), version)
-                transport.close()
-            log_coordinator(f'The version for file "{file_name}" is {version}.')
+            versions = {file_name: 0 for file_name in file_names}
+            for server_versions in self.fan_out(write_quorum, lambda client: client.get_versions(file_names)).values():
+                for file_name, server_version in server_versions.items():
+                    versions[file_name] = max(versions[file_name], server_version)
+            updates = [FileUpdate(file_name, versions[file_name] + 1, contents[file_name]) for file_name in file_names]
+            log_coordinator(f'Updating {len(updates)} files across all servers in write quorum.')
+            self.fan_out(write_quorum, lambda client: client.update_batch(updates))
+            for update in updates:
+                self.commit_version(update.file_name, update.version)
+            log_coordinator(f'Finished writing batch of {len(updates)} files.')
+        finally:
+            for file_lock in reversed(acquired_locks):
+                file_lock.release_write()
+
+    def get_delta(self, base_servers: List, file_name: str, base_version: int, content: str) -> Optional[List[DeltaOp]]:
+        data = content.encode('utf-8')
+        if self.delta_block_size <= 0 or len(data) < self.delta_block_size:
+            return None
+        try:
+            with self.connect(base_servers[0]) as client:
+                signatures = client.get_signatures(file_name, base_version, self.delta_block_size)
+        except StaleVersion as _:
+            return None
+        # Only send a delta if it is meaningfully smaller than the full contents
+        delta = compute_delta([(s.weak, s.strong) for s in signatures], data, self.delta_block_size, len(data) // 2)
+        if delta is None:
+            return None
+        # Only walk the delta to measure it when debug output is enabled
+        if DEBUG:
+            log_coordinator(f'Computed delta of {delta_size(delta)} bytes against version {base_version} of "{file_name}" ({len(data)} bytes).')
+        return [DeltaOp(block, count, literal) for block, count, literal in delta]
+
+    def write_upload(self, file_name: str, host: str, port: int, upload_id: str, size: int) -> None:
+        log_coordinator(f'Received request to write upload "{upload_id}" ({size} bytes) from {host}:{port} to "{file_name}".')
+        file_lock = self.get_file_lock(file_name)
+        self.acquire_lock(file_name, file_lock, 'write')
+        try:
+            self.revoke_leases([file_name])
+            write_quorum = self.selector.choose(self.q_write)
+            log_coordinator(f'Formed write quorum consisting of servers: {write_quorum}.')
+            version, _ = self.get_max_version(write_quorum, file_name)
             version += 1
-            log_coordinator(f'Updating file contents across all servers in write quorum.')
-            for server in write_quorum:
-                host, port = server
-                client, transport = connect_server(host, port)
-                transport.open()
-                client.update(file_name, version, content)
-                transport.close()
-            log_coordinator(f'Finished writing to "{file_name}".')
-            return
+            # Relay the upload one chunk at a time so only a single chunk is ever held in memory
+            with ExitStack() as stack:
+                source = stack.enter_context(self.connect((host, port), track=False))
+                replicas = [stack.enter_context(self.connect(server, track=False)) for server in write_quorum]
+                for offset in range(0, size, self.chunk_size):
+                    data = source.fetch_upload(upload_id, offset, self.chunk_size)
+                    self.parallel(replicas, lambda client: client.update_chunk(file_name, version, offset, data))
+                self.parallel(replicas, lambda client: client.commit_update(file_name, version, size))
+            self.commit_version(file_name, version)
+            log_coordinator(f'Finished writing upload "{upload_id}" to "{file_name}" with version {version}.')
         finally:
             file_lock.release_write()
 
     def read(self, file_name: str) -> str:
         log_coordinator(f'Received request to read contents from "{file_name}".')
         file_lock = self.get_file_lock(file_name)
-        file_lock.acquire_read()
+        self.acquire_lock(file_name, file_lock, 'read')
         try:
-            version = 0
-            read_server = None
-            read_quorum = sample(self.servers, self.q_read)
-            log_coordinator(f'Formed read quorum consisting of servers: {read_quorum}.')
-            for server in read_quorum:
-                host, port = server
-                client, transport = connect_server(host, port)
-                transport.open()
-                server_version = client.get_version(file_name)
-                log_coordinator(f'Server {host}:{port} has version {server_version} for file "{file_name}".')
-                transport.close()
-                if server_version > version:
-                    read_server = server
-                    version = server_version
-            if read_server is None:
-                log_coordinator('No server was found to have a file version number greater than 0.')
-                raise FileNotFound()
-            read_host, read_port = read_server
-            log_coordinator(f'Server {read_host}:{read_port} has the highest version ({version}) for file "{file_name}".')
-            read_client, read_transport = connect_server(read_host, read_port)
-            read_transport.open()
-            file_content = read_client.fetch(file_name)
-            read_transport.close()
-            log_coordinator(f'The contents for file "{file_name}" are "{file_content}".')
+            version, read_server = self.find_latest(file_name)
+            with self.connect(read_server) as read_client:
+                file_content = read_client.fetch(file_name)
+            self.commit_version(file_name, version)
+            if DEBUG:
+                log_coordinator(f'Read {len(file_content)} characters of version {version} of "{file_name}".')
             return file_content
         finally:
             file_lock.release_read()
 
+    def read_leased(self, file_name: str, host: str, port: int, local_version: int, cached_version: int) -> LeasedRead:
+        log_coordinator(f'Received request from server {host}:{port} with version {local_version} to read contents from "{file_name}".')
+        file_lock = self.get_file_lock(file_name)
+        self.acquire_lock(file_name, file_lock, 'read')
+        try:
+            version, read_server = self.find_latest(file_name)
+            self.commit_version(file_name, version)
+            if local_version != version:
+                # The client which made the request already has the latest version cached, so skip fetching it
+                if cached_version == version:
+                    return LeasedRead(version, 0, False, '')
+                with self.connect(read_server) as read_client:
+                    file_content = read_client.fetch(file_name)
+                return LeasedRead(version, 0, False, file_content)
+            # The requesting server already holds the latest version, let it serve this and later reads locally
+            lease_ms = 0
+            if self.lease_duration > 0:
+                with self.lease_lock:
+                    self.leases.setdefault(file_name, {})[(host, port)] = time.monotonic() + self.lease_duration
+                lease_ms = int(self.lease_duration * 1000)
+                log_coordinator(f'Granted read lease for version {version} of "{file_name}" to server {host}:{port}.')
+            return LeasedRead(version, lease_ms, True, '')
+        finally:
+            file_lock.release_read()
+
+    def read_batch(self, file_names: List[str]) -> List[ReadResult]:
+        log_coordinator(f'Received request to read a batch of {len(file_names)} files.')
+        sorted_file_names = sorted(set(file_names))
+        file_locks = [self.get_file_lock(file_name) for file_name in sorted_file_names]
+        acquired_locks = []
+        try:
+            for file_name, file_lock in zip(sorted_file_names, file_locks):
+                self.acquire_lock(file_name, file_lock, 'read')
+                acquired_locks.append(file_lock)
+            read_quorum = self.selector.choose(self.q_read)
+            log_coordinator(f'Formed read quorum consisting of servers: {read_quorum}.')
+            versions = {}
+            read_servers = {}
+            for server, server_versions in self.fan_out(read_quorum, lambda client: client.get_versions(sorted_file_names)).items():
+                for file_name, server_version in server_versions.items():
+                    if server_version > versions.get(file_name, 0):
+                        versions[file_name] = server_version
+                        read_servers[file_name] = server
+            # Fetch every file from a server with its latest version, one request per server
+            server_files = {}
+            for file_name, server in read_servers.items():
+                server_files.setdefault(server, []).append(file_name)
+            def fetch(server: Tuple[str, int]) -> Dict[str, str]:
+                with self.connect(server) as client:
+                    return client.fetch_batch(server_files[server])
+            contents = {}
+            for server_contents in self.parallel(list(server_files), fetch):
+                contents.update(server_contents)
+            for file_name, version in versions.items():
+                self.commit_version(file_name, version)
+            log_coordinator(f'Finished reading batch of {len(sorted_file_names)} files.')
+            return [ReadResult(file_name, file_name in contents, contents.get(file_name, '')) for file_name in file_names]
+        finally:
+            for file_lock in reversed(acquired_locks):
+                file_lock.release_read()
+
+    def read_chunk(self, file_name: str, version: int, offset: int, length: int) -> FileChunk:
+        log_coordinator(f'Received request to read {length} bytes at offset {offset} of version {version} of "{file_name}".')
+        file_lock = self.get_file_lock(file_name)
+        self.acquire_lock(file_name, file_lock, 'read')
+        try:
+            # Reuse the last known location of the requested version, only forming a read quorum to find the latest one
+            location = self.read_locations.get(file_name)
+            if version == 0 or location is None or location[0] != version:
+                location = self.find_latest(file_name)
+                if version != 0 and location[0] != version:
+                    raise StaleVersion(location[0])
+            read_version, read_server = location
+            try:
+                with self.connect(read_server) as read_client:
+                    data = read_client.fetch_chunk(file_name, read_version, offset, length)
+            except StaleVersion:
+                self.read_locations.pop(file_name, None)
+                raise
+            return FileChunk(read_version, data)
+        finally:
+            file_lock.release_read()
+
     def list_files(self) -> List[FileObject]:
         log_coordinator(f'Received request to list all files and versions.')
+        if not self.version_table_loaded:
+            self.load_version_table()
+        # Copy the committed versions instead of locking every file, in-flight writes are not yet visible
         with self.file_table_lock:
-            acquired_locks = []
+            snapshot = sorted(self.version_table.items())
+        log_coordinator(f'Found files and associated versions to be: {snapshot}')
+        return [FileObject(f, v) for f, v in snapshot]
+
+    def run_anti_entropy(self) -> None:
+        while True:
+            time.sleep(self.anti_entropy_interval)
             try:
-                for _, lock in self.file_table.items():
-                    lock.acquire_read()
-                    acquired_locks.append(lock)
-                file_versions = {}
-                read_quorum = sample(self.servers, self.q_read)
-                log_coordinator(f'Formed read quorum consisting of servers: {read_quorum}.')
-                for server in read_quorum:
-                    host, port = server
-                    client, transport = connect_server(host, port)
-                    transport.open()
-                    files = client.get_files()
-                    log_coordinator(f'Server {host}:{port} has files with associated versions: {files}.')
-                    transport.close()
-                    for f in files:
-                        if f.version > file_versions.get(f.file_name, 0):
-                            file_versions[f.file_name] = f.version
-                log_coordinator(f'Found files and associated versions to be: {file_versions}')
-                return [FileObject(f, v) for f, v in file_versions.items()]
-            finally:
-                for lock in acquired_locks:
-                    lock.release_read()
+                self.sync_replicas()
+            except Exception as e:
+                log_coordinator(f'Anti-entropy round failed: {e}')
+
+    def sync_replicas(self) -> None:
+        # Compare bucket digests of every reachable server and only list the buckets that differ
+        digests = {}
+        for server in self.servers:
+            try:
+                with self.connect(server) as client:
+                    digests[server] = client.get_digests(self.shard, self.num_shards, NUM_BUCKETS)
+            except TTransport.TTransportException as _:
+                log_coordinator(f'Server {server[0]}:{server[1]} is unreachable, skipping it for anti-entropy.')
+        if len(digests) < 2:
+            return
+        buckets = [b for b in range(NUM_BUCKETS) if len(set(d[b] for d in digests.values())) > 1]
+        log_coordinator(f'Found {len(buckets)} out of sync buckets across {len(digests)} servers.')
+        for bucket in buckets:
+            listings = {}
+            for server in digests:
+                with self.connect(server) as client:
+                    listings[server] = {f.file_name: f.version for f in client.get_bucket(self.shard, self.num_shards, bucket, NUM_BUCKETS)}
+            for file_name, version, source, targets in find_stale(listings):
+                self.sync_file(file_name, version, source, targets)
+
+    def sync_file(self, file_name: str, version: int, source: Tuple[str, int], targets: List[Tuple[str, int]]) -> None:
+        # The copy runs without the file's lock so that it never blocks foreground reads and writes. A write during the
+        # copy makes the source raise StaleVersion, and a stale copy that is still committed never replaces a newer one.
+        try:
+            server_versions = self.get_server_versions([source] + targets, file_name)
+            targets = [server for server in targets if server_versions[server] < version]
+            if server_versions[source] != version or len(targets) == 0:
+                return
+            log_coordinator(f'Sending version {version} of "{file_name}" from server {source[0]}:{source[1]} to stale servers {targets}.')
+            with ExitStack() as stack:
+                source_client = stack.enter_context(self.connect(source, track=False))
+                replicas = [stack.enter_context(self.connect(server, track=False)) for server in targets]
+                offset = 0
+                while True:
+                    data = source_client.fetch_chunk(file_name, version, offset, self.chunk_size)
+                    self.anti_entropy_limiter.consume(len(data) * len(replicas))
+                    for client in replicas:
+                        client.update_chunk(file_name, version, offset, data)
+                    offset += len(data)
+                    if len(data) < self.chunk_size:
+                        break
+                # Only the commit takes the read lock, which keeps it from interleaving with a write of the file
+                file_lock = self.get_file_lock(file_name)
+                self.acquire_lock(file_name, file_lock, 'read')
+                try:
+                    for client in replicas:
+                        client.commit_update(file_name, version, offset)
+                    self.commit_version(file_name, version)
+                finally:
+                    file_lock.release_read()
+        except StaleVersion as _:
+            log_coordinator(f'Version {version} of "{file_name}" was overwritten during anti-entropy, skipping it.')
 
 
 class ServerHandler:
-    def __init__(self, coordinator_host: str, coordinator_port: int, storage_path: str):
-        self.coordinator_host = coordinator_host
-        self.coordinator_port = coordinator_port
+    def __init__(self, server_host: str, server_port: int, coordinators: List, storage_path: str, durability: str, fsync_interval: float, storage_engine: str, segment_size: int, delay: float):
+        self.server_host = server_host
+        self.server_port = server_port
+        # Artificial latency added to every replica RPC, used to emulate slow or distant servers
+        self.delay = delay
+        # Static shard map, coordinator i owns every file whose name hashes to shard i
+        self.coordinators = coordinators
         self.storage_path = storage_path
-        self.version_table = {}
-        self.version_table_lock = Lock()
+        self.upload_path = os.path.join(storage_path, '.uploads')
+        shutil.rmtree(self.upload_path, ignore_errors=True)
+        Path(self.upload_path).mkdir(parents=True)
+        self.store = open_store(storage_path, storage_engine, durability, fsync_interval, segment_size)
+        # Read leases granted by the coordinators as (version, expiry time) and the time each lease was last revoked
+        self.leases = {}
+        self.revocations = {}
+        self.lease_lock = Lock()
+
+    def inject_delay(self) -> None:
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+    def get_upload_file(self, upload_id: str) -> str:
+        return os.path.join(self.upload_path, os.path.basename(upload_id))
+
+    def connect_owner(self, file_name: str) -> Tuple[CoordinatorService.Client, TSocket.TSocket]:
+        coordinator_host, coordinator_port = self.coordinators[get_shard(file_name, len(self.coordinators))]
+        return connect_coordinator(coordinator_host, coordinator_port)
 
     def write(self, file_name: str, content: str) -> None:
-        log_server(f'Received request to write "{content}" to "{file_name}".')
-        client, transport = connect_coordinator(self.coordinator_host, self.coordinator_port)
+        if DEBUG:
+            log_server(f'Received request to write {len(content)} characters to "{file_name}".')
+        client, transport = self.connect_owner(file_name)
         transport.open()
         client.write(file_name, content)
         transport.close()
@@ -169,66 +574,266 @@ class ServerHandler:
 
     def read(self, file_name: str) -> str:
         log_server(f'Received request to read contents from "{file_name}".')
-        client, transport = connect_coordinator(self.coordinator_host, self.coordinator_port)
+        return self.read_versioned(file_name, 0)[1]
+
+    def read_if_modified(self, file_name: str, version: int) -> ConditionalRead:
+        log_server(f'Received request to read contents from "{file_name}" if newer than version {version}.')
+        latest_version, content = self.read_versioned(file_name, version)
+        if content is None:
+            return ConditionalRead(latest_version, False, '')
+        return ConditionalRead(latest_version, True, content)
+
+    def read_versioned(self, file_name: str, cached_version: int) -> Tuple[int, Optional[str]]:
+        # Returns the latest version of the file and its contents, or no contents if the caller already has that version
+        with self.lease_lock:
+            lease = self.leases.get(file_name)
+        if lease is not None and time.monotonic() < lease[1]:
+            if lease[0] == cached_version:
+                return cached_version, None
+            content = self.read_local(file_name, lease[0])
+            if content is not None:
+                log_server(f'Served read of "{file_name}" locally under read lease for version {lease[0]}.')
+                return lease[0], content
+        request_time = time.monotonic()
+        client, transport = self.connect_owner(file_name)
         transport.open()
-        content = client.read(file_name)
-        transport.close()
+        try:
+            result = client.read_leased(file_name, self.server_host, self.server_port, self.store.get_version(file_name), cached_version)
+            if result.lease_ms > 0:
+                with self.lease_lock:
+                    # Ignore the lease if it was revoked while the request was in flight
+                    if self.revocations.get(file_name, 0) < request_time:
+                        self.leases[file_name] = (result.version, request_time + result.lease_ms / 1000)
+            content = result.content
+            if result.version == cached_version:
+                content = None
+            elif result.local:
+                content = self.read_local(file_name, result.version)
+                if content is None:
+                    content = client.read(file_name)
+        finally:
+            transport.close()
         log_server(f'Coordinator finished processing request to read from "{file_name}".')
-        return content
+        return result.version, content
+
+    def read_local(self, file_name: str, version: int) -> Optional[str]:
+        try:
+            data = self.store.read(file_name, version, 0, -1)
+        except (KeyError, StaleVersionError) as _:
+            return None
+        BYTES_READ.inc(len(data))
+        return data.decode('utf-8')
+
+    def get_metrics(self) -> str:
+        # Metrics of the whole process, including the coordinator if this server runs one
+        return REGISTRY.render()
+
+    def revoke_lease(self, file_name: str) -> None:
+        log_server(f'Read lease for "{file_name}" was revoked.')
+        with self.lease_lock:
+            self.leases.pop(file_name, None)
+            self.revocations[file_name] = time.monotonic()
 
     def list_files(self) -> List[FileObject]:
         log_server('Received request to list all files and versions.')
-        log_server(f'{self.coordinator_host} {self.coordinator_port}')
-        client, transport = connect_coordinator(self.coordinator_host, self.coordinator_port)
-        transport.open()    
-        files = client.list_files()
-        transport.close()
-        log_server(f'Coordinator finished processing request to list all files and versions.')
-        return files
+        files = []
+        for coordinator_host, coordinator_port in self.coordinators:
+            client, transport = connect_coordinator(coordinator_host, coordinator_port)
+            transport.open()
+            files.extend(client.list_files())
+            transport.close()
+        log_server(f'Coordinators finished processing request to list all files and versions.')
+        return sorted(files, key=lambda f: f.file_name)
+
+    def write_batch(self, writes: List[WriteOp]) -> None:
+        log_server(f'Received request to write a batch of {len(writes)} writes.')
+        shard_writes = {}
+        for write in writes:
+            shard_writes.setdefault(get_shard(write.file_name, len(self.coordinators)), []).append(write)
+        for shard, writes_for_shard in shard_writes.items():
+            client, transport = connect_coordinator(*self.coordinators[shard])
+            transport.open()
+            client.write_batch(writes_for_shard)
+            transport.close()
+        log_server(f'Coordinators finished processing request to write a batch of {len(writes)} writes.')
+
+    def read_batch(self, file_names: List[str]) -> List[ReadResult]:
+        log_server(f'Received request to read a batch of {len(file_names)} files.')
+        shard_file_names = {}
+        for file_name in file_names:
+            shard_file_names.setdefault(get_shard(file_name, len(self.coordinators)), []).append(file_name)
+        results = {}
+        for shard, shard_names in shard_file_names.items():
+            client, transport = connect_coordinator(*self.coordinators[shard])
+            transport.open()
+            for result in client.read_batch(shard_names):
+                results[result.file_name] = result
+            transport.close()
+        log_server(f'Coordinators finished processing request to read a batch of {len(file_names)} files.')
+        return [results[file_name] for file_name in file_names]
+
+    def upload_chunk(self, upload_id: str, offset: int, data: bytes) -> None:
+        log_server(f'Received {len(data)} bytes at offset {offset} for upload "{upload_id}".')
+        write_at(self.get_upload_file(upload_id), offset, data)
+
+    def commit_upload(self, file_name: str, upload_id: str, size: int) -> None:
+        log_server(f'Received request to write upload "{upload_id}" ({size} bytes) to "{file_name}".')
+        upload_file = self.get_upload_file(upload_id)
+        truncate(upload_file, size)
+        try:
+            client, transport = self.connect_owner(file_name)
+            transport.open()
+            client.write_upload(file_name, self.server_host, self.server_port, upload_id, size)
+            transport.close()
+        finally:
+            os.remove(upload_file)
+        log_server(f'Coordinator finished processing request to write upload "{upload_id}" to "{file_name}".')
+
+    def fetch_upload(self, upload_id: str, offset: int, length: int) -> bytes:
+        return read_at(self.get_upload_file(upload_id), offset, length)
+
+    def read_chunk(self, file_name: str, version: int, offset: int, length: int) -> FileChunk:
+        log_server(f'Received request to read {length} bytes at offset {offset} of "{file_name}".')
+        client, transport = self.connect_owner(file_name)
+        transport.open()
+        try:
+            return client.read_chunk(file_name, version, offset, length)
+        finally:
+            transport.close()
 
-    def get_files(self) -> List[FileObject]:
-        log_server('Received request to retrieve all files and current versions.')
-        with self.version_table_lock:
-            return [FileObject(f, v) for f, v in self.version_table.items()]
+    def get_files(self, prefix: str, start_after: str, limit: int) -> List[FileObject]:
+        log_server(f'Received request to retrieve files with prefix "{prefix}" after "{start_after}" (limit {limit}).')
+        return [FileObject(f, v) for f, v in self.store.list_versions(prefix, start_after, limit)]
 
     def get_version(self, file_name: str) -> int:
-        with self.version_table_lock:
-            return self.version_table.get(file_name, 0)
+        self.inject_delay()
+        return self.store.get_version(file_name)
 
     def update(self, file_name: str, version: int, content: str) -> None:
-        log_server(f'Updating contents of file "{file_name}" to "{content}".')
-        Path(os.path.join(self.storage_path, file_name)).write_text(content)
-        with self.version_table_lock:
-            log_server(f'Updating version for file "{file_name}" from {self.version_table.get(file_name, 0)} to {version}.')
-            self.version_table[file_name] = version
+        self.inject_delay()
+        if DEBUG:
+            log_server(f'Updating contents of file "{file_name}" to {len(content)} characters.')
+        data = content.encode('utf-8')
+        previous_version = self.store.put(file_name, version, data)
+        BYTES_WRITTEN.inc(len(data))
+        log_server(f'Updated version for file "{file_name}" from {previous_version} to {version}.')
 
     def fetch(self, file_name: str) -> str:
         log_server(f'Fetching contents of "{file_name}" for coordinator.')
-        with self.version_table_lock:
-            if file_name not in self.version_table:
-                raise FileNotFound()
-        return Path(os.path.join(self.storage_path, file_name)).read_text()
+        return self.fetch_chunk(file_name, 0, 0, -1).decode('utf-8')
+
+    def get_versions(self, file_names: List[str]) -> Dict[str, int]:
+        self.inject_delay()
+        return {file_name: self.store.get_version(file_name) for file_name in file_names}
+
+    def update_batch(self, updates: List[FileUpdate]) -> None:
+        self.inject_delay()
+        log_server(f'Updating contents of {len(updates)} files.')
+        files = [(update.file_name, update.version, update.content.encode('utf-8')) for update in updates]
+        self.store.put_batch(files)
+        BYTES_WRITTEN.inc(sum(len(data) for _, _, data in files))
+
+    def fetch_batch(self, file_names: List[str]) -> Dict[str, str]:
+        self.inject_delay()
+        log_server(f'Fetching contents of {len(file_names)} files for coordinator.')
+        contents = {}
+        for file_name in file_names:
+            try:
+                data = self.store.read(file_name, 0, 0, -1)
+            except KeyError as _:
+                continue
+            BYTES_READ.inc(len(data))
+            contents[file_name] = data.decode('utf-8')
+        return contents
+
+    def update_delta(self, file_name: str, base_version: int, version: int, block_size: int, delta: List[DeltaOp]) -> None:
+        self.inject_delay()
+        log_server(f'Updating contents of file "{file_name}" from version {base_version} with a delta of {len(delta)} operations.')
+        try:
+            previous_version = self.store.apply_delta(file_name, base_version, version, block_size, [(op.block, op.count, op.data) for op in delta])
+        except (KeyError, StaleVersionError) as _:
+            raise StaleVersion(self.store.get_version(file_name))
+        BYTES_WRITTEN.inc(sum(len(op.data) for op in delta))
+        log_server(f'Updated version for file "{file_name}" from {previous_version} to {version}.')
+
+    def get_signatures(self, file_name: str, version: int, block_size: int) -> List[BlockSignature]:
+        self.inject_delay()
+        try:
+            return [BlockSignature(weak, strong) for weak, strong in self.store.get_signatures(file_name, version, block_size)]
+        except KeyError as _:
+            raise FileNotFound()
+        except StaleVersionError as e:
+            raise StaleVersion(e.version)
+
+    def update_chunk(self, file_name: str, version: int, offset: int, data: bytes) -> None:
+        self.inject_delay()
+        log_server(f'Writing {len(data)} bytes at offset {offset} of version {version} of "{file_name}".')
+        self.store.stage(file_name, version, offset, data)
+        BYTES_WRITTEN.inc(len(data))
+
+    def commit_update(self, file_name: str, version: int, size: int) -> None:
+        self.inject_delay()
+        previous_version = self.store.commit(file_name, version, size)
+        log_server(f'Updated version for file "{file_name}" from {previous_version} to {version}.')
+
+    def fetch_chunk(self, file_name: str, version: int, offset: int, length: int) -> bytes:
+        self.inject_delay()
+        log_server(f'Fetching {length} bytes at offset {offset} of "{file_name}" for coordinator.')
+        try:
+            data = self.store.read(file_name, version, offset, length)
+        except KeyError as _:
+            raise FileNotFound()
+        except StaleVersionError as e:
+            raise StaleVersion(e.version)
+        BYTES_READ.inc(len(data))
+        return data
+
+    def get_shard_files(self, shard: int, num_shards: int) -> List[Tuple[str, int]]:
+        return [(f, v) for f, v in self.store.list_versions('', '', 0) if get_shard(f, num_shards) == shard]
 
+    def get_digests(self, shard: int, num_shards: int, num_buckets: int) -> List[int]:
+        self.inject_delay()
+        return bucket_digests(self.get_shard_files(shard, num_shards), num_buckets)
 
-def start_coordinator(coordinator_port: int, q_write: int, q_read: int, servers: List, locking_scheme: str):
-    coordinator_handler = CoordinatorHandler(q_write, q_read, servers, locking_scheme)
-    processor = CoordinatorService.Processor(coordinator_handler)
-    transport = TSocket.TServerSocket(port=coordinator_port)
+    def get_bucket(self, shard: int, num_shards: int, bucket: int, num_buckets: int) -> List[FileObject]:
+        self.inject_delay()
+        return [FileObject(f, v) for f, v in self.get_shard_files(shard, num_shards) if get_bucket(f, num_buckets) == bucket]
+
+
+def make_thrift_server(processor, port: int, server_mode: str, server_threads: int) -> TServer.TServer:
+    # The "threaded" mode starts a thread per connection, the "pool" mode serves connections with a fixed number of threads
+    transport = TSocket.TServerSocket(port=port)
     tfactory = TTransport.TBufferedTransportFactory()
     pfactory = TBinaryProtocol.TBinaryProtocolFactory()
-    server = TServer.TThreadedServer(processor, transport, tfactory, pfactory)
+    if server_mode == 'pool':
+        server = TServer.TThreadPoolServer(processor, transport, tfactory, pfactory, daemon=True)
+        server.setNumThreads(server_threads)
+        return server
+    if server_mode != 'threaded':
+        raise ValueError(f'Unknown server mode "{server_mode}".')
+    return TServer.TThreadedServer(processor, transport, tfactory, pfactory)
+
+
+def start_coordinator(coordinator_port: int, shard: int, num_shards: int, q_write: int, q_read: int, servers: List, quorum_selection: str, quorum_probe_rate: float, locking_scheme: str, list_page_size: int, chunk_size: int, delta_block_size: int, lease_duration: float, anti_entropy_interval: float, anti_entropy_rate: int, fanout_threads: int, write_coalescing: bool, server_mode: str, server_threads: int):
+    selector = ReplicaSelector(servers, quorum_selection, probe_rate=quorum_probe_rate)
+    coordinator_handler = CoordinatorHandler(shard, num_shards, q_write, q_read, servers, selector, locking_scheme, list_page_size, chunk_size, delta_block_size, lease_duration, anti_entropy_interval, anti_entropy_rate, fanout_threads, write_coalescing)
+    processor = CoordinatorService.Processor(InstrumentedHandler(coordinator_handler, 'coordinator'))
+    server = make_thrift_server(processor, coordinator_port, server_mode, server_threads)
     log_coordinator('Starting coordinator...')
     server.serve()
     log_coordinator('Done.')
 
 
-def start_server(server_port: int, coordinator_host: str, coordinator_port: int, storage_path: str):
-    server_handler = ServerHandler(coordinator_host, coordinator_port, storage_path)
-    processor = ServerService.Processor(server_handler)
-    transport = TSocket.TServerSocket(port=server_port)
-    tfactory = TTransport.TBufferedTransportFactory()
-    pfactory = TBinaryProtocol.TBinaryProtocolFactory()
-    server = TServer.TThreadedServer(processor, transport, tfactory, pfactory)
+def start_server(server_host: str, server_port: int, replica_port: int, coordinators: List, storage_path: str, durability: str, fsync_interval: float, storage_engine: str, segment_size: int, delay: float, server_mode: str, server_threads: int):
+    # Coordinators know the server by its replica port, which is also where they send their requests
+    server_handler = ServerHandler(server_host, replica_port, coordinators, storage_path, durability, fsync_interval, storage_engine, segment_size, delay)
+    processor = ServerService.Processor(InstrumentedHandler(server_handler, 'server'))
+    if replica_port != server_port:
+        # Requests from coordinators get a thread per connection, so they never wait for a thread held by a client
+        # request which is itself waiting for the coordinator
+        replica_server = make_thrift_server(processor, replica_port, 'threaded', 0)
+        Thread(target=replica_server.serve, daemon=True).start()
+    server = make_thrift_server(processor, server_port, server_mode, server_threads)
     log_server('Starting server...')
     server.serve()
     log_server('Done.')
@@ -250,28 +855,56 @@ def main():
     coordinator_port = config.get('coordinator_port', 8080)
     coordinator_sleep_delay = config.get('coordinator_sleep_delay', 3)
     locking_scheme = config.get('locking_scheme', 'default')
+    quorum_selection = config.get('quorum_selection', 'random')
+    quorum_probe_rate = config.get('quorum_probe_rate', 0.05)
+    list_page_size = config.get('list_page_size', 1000)
+    chunk_size = config.get('chunk_size', 1048576)
+    delta_block_size = config.get('delta_block_size', 4096)
+    lease_duration = config.get('lease_duration', 0)
+    anti_entropy_interval = config.get('anti_entropy_interval', 0)
+    anti_entropy_rate = config.get('anti_entropy_rate', 1048576)
+    durability = config.get('durability', 'group')
+    fsync_interval = config.get('fsync_interval', 1.0)
+    storage_engine = config.get('storage_engine', 'flat')
+    segment_size = config.get('segment_size', 67108864)
+    server_mode = config.get('server_mode', 'threaded')
+    server_threads = config.get('server_threads', 64)
+    fanout_threads = config.get('fanout_threads', 16)
+    write_coalescing = config.get('write_coalescing', False)
 
     server_info = config['servers'][server_num]
     host = server_info['host']
     port = server_info['port']
+    replica_port = server_info.get('replica_port', port)
     is_coordinator = server_info.get('coordinator', False)
-    coordinator_host = next((s['host'] for s in config['servers'] if s.get('coordinator', False)), None)
-    if coordinator_host is None:
+    delay = server_info.get('delay', 0)
+    metrics_port = server_info.get('metrics_port', 0)
+    # Every coordinator owns one shard of the file namespace, in the order they appear in the configuration file
+    coordinators = [(s['host'], s.get('coordinator_port', coordinator_port)) for s in config['servers'] if s.get('coordinator', False)]
+    if len(coordinators) == 0:
         print('[Server] Error, coordinator not provided in configuration file.')
         return
+    # In pool mode a client request holds a thread of its server while the coordinator sends requests back to the
+    # servers, which would deadlock once every thread is held, so those requests need a separate replica port
+    if server_mode == 'pool' and any(s.get('replica_port', s['port']) == s['port'] for s in config['servers']):
+        print('[Server] Error, the "pool" server mode requires a separate replica_port for every server.')
+        return
 
     Path(storage_path).mkdir(parents=True, exist_ok=True)
+    if metrics_port > 0:
+        start_metrics_server(metrics_port)
 
     coordinator_thread = None
     if is_coordinator:
         log_coordinator('Initializing coordinator handler...')
-        servers = [(s['host'], s['port']) for s in config['servers']]
-        coordinator_thread = Thread(target=start_coordinator, args=(coordinator_port, q_write, q_read, servers, locking_scheme,))
+        servers = [(s['host'], s.get('replica_port', s['port'])) for s in config['servers']]
+        shard = coordinators.index((host, server_info.get('coordinator_port', coordinator_port)))
+        coordinator_thread = Thread(target=start_coordinator, args=(coordinators[shard][1], shard, len(coordinators), q_write, q_read, servers, quorum_selection, quorum_probe_rate, locking_scheme, list_page_size, chunk_size, delta_block_size, lease_duration, anti_entropy_interval, anti_entropy_rate, fanout_threads, write_coalescing, server_mode, server_threads,))
         coordinator_thread.start()
     else:
         time.sleep(coordinator_sleep_delay)
 
-    start_server(port, coordinator_host, coordinator_port, storage_path)
+    start_server(host, port, replica_port, coordinators, storage_path, durability, fsync_interval, storage_engine, segment_size, delay, server_mode, server_threads)
     coordinator_thread.join()
 
 
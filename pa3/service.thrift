@@ -1,23 +1,97 @@
 exception FileNotFound {
 }
 
+exception StaleVersion {
+    1: i32 version;
+}
+
 struct FileObject {
     1: string file_name;
     2: i32 version;
 }
 
+struct FileChunk {
+    1: i32 version;
+    2: binary data;
+}
+
+struct LeasedRead {
+    1: i32 version;
+    2: i32 lease_ms;
+    3: bool local;
+    4: string content;
+}
+
+struct ConditionalRead {
+    1: i32 version;
+    2: bool modified;
+    3: string content;
+}
+
+struct WriteOp {
+    1: string file_name;
+    2: string content;
+}
+
+struct FileUpdate {
+    1: string file_name;
+    2: i32 version;
+    3: string content;
+}
+
+struct ReadResult {
+    1: string file_name;
+    2: bool found;
+    3: string content;
+}
+
+struct BlockSignature {
+    1: i64 weak;
+    2: binary strong;
+}
+
+struct DeltaOp {
+    1: i64 block;
+    2: i32 count;
+    3: binary data;
+}
+
 service CoordinatorService {
     void write(1:string file_name, 2:string content);
     string read(1:string file_name) throws (1:FileNotFound error);
+    LeasedRead read_leased(1:string file_name, 2:string host, 3:i32 port, 4:i32 local_version, 5:i32 cached_version) throws (1:FileNotFound error);
     list<FileObject> list_files();
+    void write_batch(1:list<WriteOp> writes);
+    list<ReadResult> read_batch(1:list<string> file_names);
+    void write_upload(1:string file_name, 2:string host, 3:i32 port, 4:string upload_id, 5:i64 size);
+    FileChunk read_chunk(1:string file_name, 2:i32 version, 3:i64 offset, 4:i32 length) throws (1:FileNotFound error, 2:StaleVersion stale);
 }
 
 service ServerService {
     void write(1:string file_name, 2:string content);
     string read(1:string file_name) throws (1:FileNotFound error);
+    ConditionalRead read_if_modified(1:string file_name, 2:i32 version) throws (1:FileNotFound error);
     list<FileObject> list_files();
-    list<FileObject> get_files();
+    void write_batch(1:list<WriteOp> writes);
+    list<ReadResult> read_batch(1:list<string> file_names);
+    void upload_chunk(1:string upload_id, 2:i64 offset, 3:binary data);
+    void commit_upload(1:string file_name, 2:string upload_id, 3:i64 size);
+    binary fetch_upload(1:string upload_id, 2:i64 offset, 3:i32 length);
+    FileChunk read_chunk(1:string file_name, 2:i32 version, 3:i64 offset, 4:i32 length) throws (1:FileNotFound error, 2:StaleVersion stale);
+    list<FileObject> get_files(1:string prefix, 2:string start_after, 3:i32 limit);
     i32 get_version(1:string file_name);
+    void revoke_lease(1:string file_name);
+    map<string, i32> get_versions(1:list<string> file_names);
     void update(1:string file_name, 2:i32 version, 3:string content);
+    void update_delta(1:string file_name, 2:i32 base_version, 3:i32 version, 4:i32 block_size, 5:list<DeltaOp> delta) throws (1:StaleVersion stale);
+    list<BlockSignature> get_signatures(1:string file_name, 2:i32 version, 3:i32 block_size) throws (1:FileNotFound error, 2:StaleVersion stale);
     string fetch(1:string file_name) throws (1:FileNotFound error);
+    void update_batch(1:list<FileUpdate> updates);
+    map<string, string> fetch_batch(1:list<string> file_names);
+    void update_chunk(1:string file_name, 2:i32 version, 3:i64 offset, 4:binary data);
+    void commit_update(1:string file_name, 2:i32 version, 3:i64 size);
+    binary fetch_chunk(1:string file_name, 2:i32 version, 3:i64 offset, 4:i32 length) throws (1:FileNotFound error, 2:StaleVersion stale);
+    list<i64> get_digests(1:i32 shard, 2:i32 num_shards, 3:i32 num_buckets);
+    list<FileObject> get_bucket(1:i32 shard, 2:i32 num_shards, 3:i32 bucket, 4:i32 num_buckets);
+    string get_metrics();
 }
\ No newline at end of file
@@ -0,0 +1,581 @@
+import os
+import time
+import shutil
+from bisect import bisect_left, bisect_right, insort
+from pathlib import Path
+from threading import Lock, Condition, Thread
+from typing import Dict, List, Set, Tuple
+
+from utils import write_at, truncate
+from delta import block_signatures
+
+DURABILITY_LEVELS = ['none', 'async', 'group', 'sync']
+STORAGE_ENGINES = ['flat', 'packed']
+# Number of blocks read at a time when computing signatures or applying a delta
+BLOCKS_PER_READ = 256
+
+
+class StaleVersionError(Exception):
+    def __init__(self, version: int):
+        super().__init__(version)
+        self.version = version
+
+
+def page_names(file_names: List[str], prefix: str, start_after: str, limit: int) -> List[str]:
+    # Names sharing the prefix are contiguous in the sorted list, so a page only looks at the names it returns
+    if start_after < prefix:
+        start = bisect_left(file_names, prefix)
+    else:
+        start = bisect_right(file_names, start_after)
+    page = []
+    for file_name in file_names[start:start + limit] if limit > 0 else file_names[start:]:
+        if not file_name.startswith(prefix):
+            break
+        page.append(file_name)
+    return page
+
+
+def fsync_path(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class VersionLog:
+    """
+    Append-only log of committed records, each made up of a file name and num_fields integers
+    starting with the version of the file.
+
+    With the "none" durability level records are only flushed to the OS, with "async" they are
+    additionally fsynced by a background thread every fsync_interval seconds, with "group" each
+    writer waits for an fsync that is shared by every record appended while the previous fsync
+    was running and with "sync" every record is fsynced on its own.
+    """
+    def __init__(self, path: str, durability: str, fsync_interval: float, sync_paths: List[str], num_fields: int = 1):
+        self.path = path
+        self.num_fields = num_fields
+        self.durability = durability
+        self.fsync_interval = fsync_interval
+        # Directories that must be fsynced together with the log, e.g. the staging directory
+        self.sync_paths = sync_paths
+        self.cv = Condition(Lock())
+        self.file = None
+        self.appended = 0
+        self.synced = 0
+        self.syncing = False
+
+    def replay(self) -> List[Tuple[str, Tuple[int, ...]]]:
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                # A torn record at the end of the log was never acknowledged, skip it
+                if not line.endswith('\n'):
+                    break
+                parts = line[:-1].split(' ', self.num_fields)
+                if len(parts) == self.num_fields + 1 and all(part.isdigit() for part in parts[:-1]):
+                    records.append((parts[-1], tuple(int(part) for part in parts[:-1])))
+        return records
+
+    def open(self, records: Dict[str, Tuple[int, ...]]) -> None:
+        # Rewrite the log as a snapshot of the current records so the next startup only reads one record per file
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for file_name, values in records.items():
+                file.write(f'{self.format_values(values)} {file_name}\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        fsync_path(os.path.dirname(self.path))
+        self.file = open(self.path, 'a', encoding='utf-8')
+        if self.durability == 'async':
+            Thread(target=self.sync_periodically, daemon=True).start()
+
+    def format_values(self, values: Tuple[int, ...]) -> str:
+        return ' '.join(str(value) for value in values)
+
+    def append(self, records: List[Tuple[str, Tuple[int, ...]]]) -> None:
+        with self.cv:
+            for file_name, values in records:
+                self.file.write(f'{self.format_values(values)} {file_name}\n')
+            self.file.flush()
+            self.appended += 1
+            sequence = self.appended
+            if self.durability == 'sync':
+                self.sync_locked(sequence)
+        if self.durability == 'group':
+            self.wait_for_sync(sequence)
+
+    def sync(self) -> None:
+        # Waits until every record appended so far is durable, regardless of the durability level
+        with self.cv:
+            sequence = self.appended
+        self.wait_for_sync(sequence)
+
+    def sync_locked(self, sequence: int) -> None:
+        for path in self.sync_paths:
+            fsync_path(path)
+        os.fsync(self.file.fileno())
+        self.synced = max(self.synced, sequence)
+
+    def wait_for_sync(self, sequence: int) -> None:
+        with self.cv:
+            while self.synced < sequence:
+                if self.syncing:
+                    self.cv.wait()
+                    continue
+                # Become the leader and fsync every record appended so far on behalf of all waiting writers
+                self.syncing = True
+                target = self.appended
+                self.cv.release()
+                try:
+                    for path in self.sync_paths:
+                        fsync_path(path)
+                    os.fsync(self.file.fileno())
+                finally:
+                    self.cv.acquire()
+                    self.syncing = False
+                    self.synced = max(self.synced, target)
+                    self.cv.notify_all()
+
+    def sync_periodically(self) -> None:
+        while True:
+            with self.cv:
+                self.cv.wait(self.fsync_interval)
+                target = self.appended
+            if target > self.synced:
+                self.wait_for_sync(target)
+
+
+class FileStore:
+    """
+    Stores each file as a flat file in the files directory of the storage path together with a log of
+    committed versions. Keeping the files apart from the log and the staging directory means that no
+    file name can overwrite them.
+
+    New contents are written to a staging file, fsynced, logged and then atomically renamed into
+    place. On startup the log is replayed, staged files whose commit was logged but not yet renamed
+    are moved into place and every other staged file is discarded.
+    """
+    def __init__(self, storage_path: str, durability: str = 'group', fsync_interval: float = 1.0):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f'Unknown durability level "{durability}".')
+        self.storage_path = storage_path
+        self.staging_path = os.path.join(storage_path, '.staging')
+        self.files_path = os.path.join(storage_path, 'files')
+        self.durability = durability
+        Path(self.staging_path).mkdir(parents=True, exist_ok=True)
+        Path(self.files_path).mkdir(exist_ok=True)
+        self.lock = Lock()
+        self.versions = {}
+        # Sorted names of every stored file, so listings can be paged without sorting every file
+        self.file_names: List[str] = []
+        self.log = VersionLog(os.path.join(storage_path, '.versions.log'), durability, fsync_interval, [self.staging_path, self.files_path])
+        self.recover()
+
+    def recover(self) -> None:
+        for file_name, (version,) in self.log.replay():
+            if version > self.versions.get(file_name, 0):
+                self.versions[file_name] = version
+        for file_name, version in self.versions.items():
+            staging_file = self.get_staging_file(file_name, version)
+            if os.path.exists(staging_file):
+                os.replace(staging_file, self.get_file(file_name))
+        self.file_names = sorted(self.versions)
+        shutil.rmtree(self.staging_path)
+        Path(self.staging_path).mkdir()
+        self.log.open({file_name: (version,) for file_name, version in self.versions.items()})
+
+    def get_staging_file(self, file_name: str, version: int) -> str:
+        return os.path.join(self.staging_path, f'{file_name}.{version}')
+
+    def get_file(self, file_name: str) -> str:
+        return os.path.join(self.files_path, file_name)
+
+    def get_version(self, file_name: str) -> int:
+        with self.lock:
+            return self.versions.get(file_name, 0)
+
+    def list_versions(self, prefix: str, start_after: str, limit: int) -> List[Tuple[str, int]]:
+        with self.lock:
+            return [(f, self.versions[f]) for f in page_names(self.file_names, prefix, start_after, limit)]
+
+    def stage(self, file_name: str, version: int, offset: int, data: bytes) -> None:
+        write_at(self.get_staging_file(file_name, version), offset, data)
+
+    def put(self, file_name: str, version: int, data: bytes) -> int:
+        return self.put_batch([(file_name, version, data)])[0]
+
+    def put_batch(self, files: List[Tuple[str, int, bytes]]) -> List[int]:
+        for file_name, version, data in files:
+            staging_file = self.get_staging_file(file_name, version)
+            truncate(staging_file, len(data))
+            write_at(staging_file, 0, data)
+        return self.commit_batch([(file_name, version, len(data)) for file_name, version, data in files])
+
+    def commit(self, file_name: str, version: int, size: int) -> int:
+        return self.commit_batch([(file_name, version, size)])[0]
+
+    def commit_batch(self, files: List[Tuple[str, int, int]]) -> List[int]:
+        # Every file in the batch shares a single log append and fsync
+        for file_name, version, size in files:
+            staging_file = self.get_staging_file(file_name, version)
+            truncate(staging_file, size)
+            if self.durability in ('group', 'sync'):
+                fsync_path(staging_file)
+        # The log record makes the commit durable, a crash before the rename is redone on recovery
+        self.log.append([(file_name, (version,)) for file_name, version, _ in files])
+        previous_versions = []
+        with self.lock:
+            for file_name, version, _ in files:
+                staging_file = self.get_staging_file(file_name, version)
+                previous_version = self.versions.get(file_name, 0)
+                previous_versions.append(previous_version)
+                if version <= previous_version:
+                    os.remove(staging_file)
+                    continue
+                os.replace(staging_file, self.get_file(file_name))
+                if previous_version == 0:
+                    insort(self.file_names, file_name)
+                self.versions[file_name] = version
+        return previous_versions
+
+    def open(self, file_name: str, version: int = 0) -> int:
+        # Opens the file while holding the lock so a concurrent commit cannot swap it out from under the caller
+        with self.lock:
+            current_version = self.versions.get(file_name, 0)
+            if current_version == 0:
+                raise KeyError(file_name)
+            if version != 0 and version != current_version:
+                raise StaleVersionError(current_version)
+            return os.open(self.get_file(file_name), os.O_RDONLY)
+
+    def read(self, file_name: str, version: int, offset: int, length: int) -> bytes:
+        fd = self.open(file_name, version)
+        try:
+            if length < 0:
+                length = os.fstat(fd).st_size - offset
+            return os.pread(fd, length, offset)
+        finally:
+            os.close(fd)
+
+    def get_signatures(self, file_name: str, version: int, block_size: int) -> List[Tuple[int, bytes]]:
+        fd = self.open(file_name, version)
+        try:
+            signatures = []
+            offset = 0
+            while True:
+                data = os.pread(fd, block_size * BLOCKS_PER_READ, offset)
+                signatures.extend(block_signatures(data, block_size))
+                if len(data) < block_size * BLOCKS_PER_READ:
+                    return signatures
+                offset += len(data)
+        finally:
+            os.close(fd)
+
+    def apply_delta(self, file_name: str, base_version: int, version: int, block_size: int, delta: List[Tuple[int, int, bytes]]) -> int:
+        # Rebuild the new version in a staging file from blocks of the base version and literal bytes
+        base_fd = self.open(file_name, base_version)
+        staging_fd = os.open(self.get_staging_file(file_name, version), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        size = 0
+        try:
+            for block, count, literal in delta:
+                if count <= 0:
+                    size += os.pwrite(staging_fd, literal, size)
+                    continue
+                for start in range(block, block + count, BLOCKS_PER_READ):
+                    num_blocks = min(BLOCKS_PER_READ, block + count - start)
+                    data = os.pread(base_fd, num_blocks * block_size, start * block_size)
+                    size += os.pwrite(staging_fd, data, size)
+        finally:
+            os.close(base_fd)
+            os.close(staging_fd)
+        return self.commit(file_name, version, size)
+
+
+class PackedStore:
+    """
+    Stores the contents of every file as a record in a small number of large, append-only segment
+    files, with an in-memory index mapping each file name to (version, segment, offset, length).
+
+    Every commit appends the new contents to the current segment and then appends the new location
+    to a log, which is replayed on startup to rebuild the index. Once the current segment grows past
+    segment_size bytes a new one is started. A background thread rewrites the live records of sealed
+    segments in which less than compaction_threshold of the bytes are still live into the current
+    segment and then deletes them.
+    """
+    def __init__(self, storage_path: str, durability: str = 'group', fsync_interval: float = 1.0, segment_size: int = 64 << 20,
+                 compaction_interval: float = 60, compaction_threshold: float = 0.5):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f'Unknown durability level "{durability}".')
+        self.storage_path = storage_path
+        self.staging_path = os.path.join(storage_path, '.staging')
+        self.segments_path = os.path.join(storage_path, '.segments')
+        self.durability = durability
+        self.segment_size = segment_size
+        self.compaction_threshold = compaction_threshold
+        Path(self.staging_path).mkdir(parents=True, exist_ok=True)
+        Path(self.segments_path).mkdir(parents=True, exist_ok=True)
+        # Guards the index, the byte counts and the read file descriptors
+        self.lock = Lock()
+        # Serializes appends to the current segment
+        self.append_lock = Lock()
+        self.index: Dict[str, Tuple[int, int, int, int]] = {}
+        # Sorted names of every stored file, so listings can be paged without sorting every file
+        self.file_names: List[str] = []
+        self.live_bytes: Dict[int, int] = {}
+        self.total_bytes: Dict[int, int] = {}
+        self.read_fds: Dict[int, int] = {}
+        # Number of reads using each read descriptor, a descriptor of a deleted segment is only closed once no read
+        # uses it anymore, since its number could otherwise be reused for another file while the read is running
+        self.fd_readers: Dict[int, int] = {}
+        self.retired_fds: Set[int] = set()
+        self.sync_paths = [self.segments_path]
+        self.log = VersionLog(os.path.join(storage_path, '.packed.log'), durability, fsync_interval, self.sync_paths, num_fields=4)
+        self.segment = 0
+        self.segment_fd = -1
+        self.segment_offset = 0
+        self.recover()
+        if compaction_interval > 0:
+            Thread(target=self.compact_periodically, args=(compaction_interval,), daemon=True).start()
+
+    def recover(self) -> None:
+        segment_sizes = {}
+        for name in os.listdir(self.segments_path):
+            if name.endswith('.seg'):
+                segment_sizes[int(name.split('.')[0])] = os.path.getsize(os.path.join(self.segments_path, name))
+        for file_name, (version, segment, offset, length) in self.log.replay():
+            # Skip records whose contents never made it to disk or whose segment was already compacted
+            if offset + length > segment_sizes.get(segment, -1):
+                continue
+            # A later record for the same version is a compacted copy and replaces the previous location
+            if version >= self.index.get(file_name, (0,))[0]:
+                self.index[file_name] = (version, segment, offset, length)
+        live_segments = {entry[1] for entry in self.index.values()}
+        for segment, size in segment_sizes.items():
+            # Segments without any live records were either fully compacted or never committed
+            if segment not in live_segments:
+                os.remove(self.get_segment_file(segment))
+                continue
+            self.total_bytes[segment] = size
+            self.live_bytes[segment] = 0
+        for _, segment, _, length in self.index.values():
+            self.live_bytes[segment] += length
+        self.file_names = sorted(self.index)
+        shutil.rmtree(self.staging_path)
+        Path(self.staging_path).mkdir()
+        self.log.open(self.index)
+        # Never append to a segment that may end in a torn write
+        self.open_segment(max(segment_sizes, default=0) + 1)
+
+    def get_segment_file(self, segment: int) -> str:
+        return os.path.join(self.segments_path, f'{segment:08d}.seg')
+
+    def get_staging_file(self, file_name: str, version: int) -> str:
+        return os.path.join(self.staging_path, f'{file_name}.{version}')
+
+    def open_segment(self, segment: int) -> None:
+        # Must be called while holding the append lock, or during startup
+        if self.segment_fd >= 0:
+            # Seal the previous segment, later fsyncs of the log only cover the new one
+            os.fsync(self.segment_fd)
+            os.close(self.segment_fd)
+        self.segment = segment
+        self.segment_fd = os.open(self.get_segment_file(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.segment_offset = 0
+        fsync_path(self.segments_path)
+        self.sync_paths[1:] = [self.get_segment_file(segment)]
+        with self.lock:
+            self.live_bytes[segment] = 0
+            self.total_bytes[segment] = 0
+
+    def append_data(self, chunks) -> Tuple[int, int, int]:
+        # Appends the given chunks as a single record and returns its (segment, offset, length)
+        with self.append_lock:
+            if self.segment_offset >= self.segment_size:
+                self.open_segment(self.segment + 1)
+            segment = self.segment
+            offset = self.segment_offset
+            for chunk in chunks:
+                view = memoryview(chunk)
+                while len(view) > 0:
+                    view = view[os.write(self.segment_fd, view):]
+            length = self.segment_offset = os.lseek(self.segment_fd, 0, os.SEEK_CUR)
+            length -= offset
+            with self.lock:
+                self.total_bytes[segment] += length
+            return segment, offset, length
+
+    def acquire_read_fd(self, segment: int) -> int:
+        # Must be called while holding the lock, the descriptor must be released with release_read_fd after reading
+        fd = self.read_fds.get(segment)
+        if fd is None:
+            fd = self.read_fds[segment] = os.open(self.get_segment_file(segment), os.O_RDONLY)
+        self.fd_readers[fd] = self.fd_readers.get(fd, 0) + 1
+        return fd
+
+    def release_read_fd(self, fd: int) -> None:
+        with self.lock:
+            self.fd_readers[fd] -= 1
+            if self.fd_readers[fd] > 0:
+                return
+            del self.fd_readers[fd]
+            if fd in self.retired_fds:
+                self.retired_fds.remove(fd)
+                os.close(fd)
+
+    def get_version(self, file_name: str) -> int:
+        with self.lock:
+            return self.index.get(file_name, (0,))[0]
+
+    def list_versions(self, prefix: str, start_after: str, limit: int) -> List[Tuple[str, int]]:
+        with self.lock:
+            return [(f, self.index[f][0]) for f in page_names(self.file_names, prefix, start_after, limit)]
+
+    def stage(self, file_name: str, version: int, offset: int, data: bytes) -> None:
+        write_at(self.get_staging_file(file_name, version), offset, data)
+
+    def put(self, file_name: str, version: int, data: bytes) -> int:
+        return self.put_batch([(file_name, version, data)])[0]
+
+    def put_batch(self, files: List[Tuple[str, int, bytes]]) -> List[int]:
+        records = [(file_name, (version,) + self.append_data([data])) for file_name, version, data in files]
+        return self.commit_records(records)
+
+    def commit(self, file_name: str, version: int, size: int) -> int:
+        return self.commit_batch([(file_name, version, size)])[0]
+
+    def commit_batch(self, files: List[Tuple[str, int, int]]) -> List[int]:
+        records = []
+        for file_name, version, size in files:
+            staging_file = self.get_staging_file(file_name, version)
+            truncate(staging_file, size)
+            with open(staging_file, 'rb') as file:
+                location = self.append_data(iter(lambda: file.read(1 << 20), b''))
+            os.remove(staging_file)
+            records.append((file_name, (version,) + location))
+        return self.commit_records(records)
+
+    def commit_records(self, records: List[Tuple[str, Tuple[int, int, int, int]]]) -> List[int]:
+        # The log record makes the commit durable, the contents were already appended to a segment
+        self.log.append(records)
+        previous_versions = []
+        with self.lock:
+            for file_name, entry in records:
+                previous = self.index.get(file_name)
+                previous_versions.append(previous[0] if previous is not None else 0)
+                # Like replaying the log, a later record for the same version replaces the previous location
+                if previous is not None and entry[0] < previous[0]:
+                    continue
+                self.index[file_name] = entry
+                self.live_bytes[entry[1]] += entry[3]
+                if previous is not None:
+                    self.live_bytes[previous[1]] -= previous[3]
+                else:
+                    insort(self.file_names, file_name)
+        return previous_versions
+
+    def locate(self, file_name: str, version: int) -> Tuple[int, int, int]:
+        # Returns a descriptor of the segment holding the file with the offset and length of its contents, the
+        # descriptor must be released with release_read_fd after reading
+        with self.lock:
+            entry = self.index.get(file_name)
+            if entry is None:
+                raise KeyError(file_name)
+            if version != 0 and version != entry[0]:
+                raise StaleVersionError(entry[0])
+            return self.acquire_read_fd(entry[1]), entry[2], entry[3]
+
+    def read(self, file_name: str, version: int, offset: int, length: int) -> bytes:
+        fd, start, size = self.locate(file_name, version)
+        try:
+            offset = min(offset, size)
+            if length < 0 or offset + length > size:
+                length = size - offset
+            return os.pread(fd, length, start + offset)
+        finally:
+            self.release_read_fd(fd)
+
+    def get_signatures(self, file_name: str, version: int, block_size: int) -> List[Tuple[int, bytes]]:
+        fd, start, size = self.locate(file_name, version)
+        try:
+            signatures = []
+            for offset in range(0, size, block_size * BLOCKS_PER_READ):
+                data = os.pread(fd, min(block_size * BLOCKS_PER_READ, size - offset), start + offset)
+                signatures.extend(block_signatures(data, block_size))
+            return signatures
+        finally:
+            self.release_read_fd(fd)
+
+    def apply_delta(self, file_name: str, base_version: int, version: int, block_size: int, delta: List[Tuple[int, int, bytes]]) -> int:
+        # Rebuild the new version in a staging file from blocks of the base version and literal bytes
+        base_fd, start, base_size = self.locate(file_name, base_version)
+        staging_fd = os.open(self.get_staging_file(file_name, version), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        size = 0
+        try:
+            for block, count, literal in delta:
+                if count <= 0:
+                    size += os.pwrite(staging_fd, literal, size)
+                    continue
+                for first in range(block, block + count, BLOCKS_PER_READ):
+                    num_blocks = min(BLOCKS_PER_READ, block + count - first)
+                    length = max(0, min(num_blocks * block_size, base_size - first * block_size))
+                    data = os.pread(base_fd, length, start + first * block_size)
+                    size += os.pwrite(staging_fd, data, size)
+        finally:
+            self.release_read_fd(base_fd)
+            os.close(staging_fd)
+        return self.commit(file_name, version, size)
+
+    def compact_periodically(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            self.compact()
+
+    def compact(self) -> None:
+        with self.lock:
+            segments = [s for s in self.total_bytes if s != self.segment and self.total_bytes[s] > 0 and self.live_bytes[s] < self.compaction_threshold * self.total_bytes[s]]
+        for segment in segments:
+            self.compact_segment(segment)
+
+    def compact_segment(self, segment: int) -> None:
+        with self.lock:
+            entries = [(file_name, entry) for file_name, entry in self.index.items() if entry[1] == segment]
+            fd = self.acquire_read_fd(segment)
+        try:
+            for file_name, entry in entries:
+                version, _, offset, length = entry
+                location = self.append_data([os.pread(fd, length, offset)])
+                self.log.append([(file_name, (version,) + location)])
+                with self.lock:
+                    # The file may have been overwritten while its contents were copied, the copy is then garbage
+                    if self.index.get(file_name) == entry:
+                        self.index[file_name] = (version,) + location
+                        self.live_bytes[location[0]] += length
+                        self.live_bytes[segment] -= length
+        finally:
+            self.release_read_fd(fd)
+        # The new locations must be durable before the old segment is deleted
+        self.log.sync()
+        with self.lock:
+            if self.live_bytes[segment] > 0:
+                return
+            del self.live_bytes[segment]
+            del self.total_bytes[segment]
+            fd = self.read_fds.pop(segment, None)
+            if fd in self.fd_readers:
+                self.retired_fds.add(fd)
+            elif fd is not None:
+                os.close(fd)
+        os.remove(self.get_segment_file(segment))
+
+
+def open_store(storage_path: str, storage_engine: str, durability: str, fsync_interval: float, segment_size: int):
+    if storage_engine == 'packed':
+        return PackedStore(storage_path, durability, fsync_interval, segment_size)
+    if storage_engine != 'flat':
+        raise ValueError(f'Unknown storage engine "{storage_engine}".')
+    return FileStore(storage_path, durability, fsync_interval)
@@ -1,6 +1,36 @@
+import os
 import json
+import hashlib
 
 def load_config(config_file) -> dict: 
     with open(config_file, 'r') as file:
         data = file.read()
-    return json.loads(data)
\ No newline at end of file
+    return json.loads(data)
+
+# Maps a file name to one of "num_shards" shards using a hash that is stable across processes
+def get_shard(file_name: str, num_shards: int) -> int:
+    return int.from_bytes(hashlib.sha256(file_name.encode('utf-8')).digest()[:8], 'little', signed=False) % num_shards
+
+# Writes "data" at the given byte offset of a file, creating the file if needed
+def write_at(path: str, offset: int, data: bytes) -> None:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+
+# Reads at most "length" bytes starting at the given byte offset of a file
+def read_at(path: str, offset: int, length: int) -> bytes:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.pread(fd, length, offset)
+    finally:
+        os.close(fd)
+
+# Sets the size of a file, creating the file if needed
+def truncate(path: str, size: int) -> None:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, size)
+    finally:
+        os.close(fd)